@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adding one run to a large project description file, pandas rewrite against streaming merge.
+
+Usage: python -m benchmarks.bench_desc_file --records 200000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from flufl.lock import Lock
+
+from benchmarks.bench_records import synthetic_runs
+from fetchtool.fetch_reads import FetchReads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fetch = FetchReads(argv=["-p", "ERP000001", "-d", tmpdir])
+        os.makedirs(fetch.get_project_workdir("ERP000001"))
+        _, entries = fetch._map_portal_pages([list(synthetic_runs(args.records + 1))])
+        rows = [fetch.map_project_info_to_row(e) for e in entries]
+        fetch.write_project_description_file("ERP000001", rows[:-1])
+        new_row = [fetch.clean_data_row(rows[-1])]
+        print(f"{args.records} runs in the description file")
+
+        for label, write in [
+            ("pandas rewrite", lambda: fetch._rewrite_project_description_file("ERP000001", new_row)),
+            ("streaming merge", lambda: fetch.write_project_description_file("ERP000001", rows[-1:])),
+        ]:
+            lock_time = 0
+
+            class TimedLock(Lock):
+                def lock(self, *args, **kwargs):
+                    result = super().lock(*args, **kwargs)
+                    self.locked_at = time.perf_counter()
+                    return result
+
+                def unlock(self, *args, **kwargs):
+                    nonlocal lock_time
+                    lock_time += time.perf_counter() - self.locked_at
+                    return super().unlock(*args, **kwargs)
+
+            with patch("fetchtool.abstract_fetch.Lock", TimedLock):
+                start = time.perf_counter()
+                write()
+                elapsed = time.perf_counter() - start
+            print(f"{label:<32} {elapsed:8.3f} s, lock held {lock_time:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""--fix-desc-file over many projects, pandas rewrite against streaming reconciliation.
+
+Usage: python -m benchmarks.bench_fix_desc_file --projects 200 --records 2000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_records import synthetic_runs
+from fetchtool.fetch_reads import FetchReads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        projects = [f"ERP{i:06d}" for i in range(args.projects)]
+        fetch = FetchReads(argv=["-p", projects[0], "-d", tmpdir, "--fix-desc-file"])
+        _, entries = fetch._map_portal_pages([list(synthetic_runs(args.records))])
+        rows = [fetch.map_project_info_to_row(e) for e in entries]
+        # half of the runs are in the description file, three quarters are downloaded
+        for project in projects:
+            os.makedirs(fetch.get_project_rawdir(project))
+            fetch._merge_project_description_file(project, list(map(fetch.clean_data_row, rows[: len(rows) // 2])))
+            for row in rows[: len(rows) * 3 // 4]:
+                open(os.path.join(fetch.get_project_rawdir(project), row["file"][0]), "w").close()
+        print(f"{args.projects} projects of {args.records} runs")
+
+        for label, fix in [
+            ("pandas rewrite", lambda p: fetch._rewrite_project_description_file(p, list(map(fetch.clean_data_row, rows)))),
+            ("streaming reconciliation", lambda p: fetch.write_project_description_file(p, rows)),
+        ]:
+            start = time.perf_counter()
+            for project in projects:
+                fix(project)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            fix(projects[0])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{label:<32} {elapsed:8.2f} s {args.projects / elapsed:8.1f} projects/s, peak {peak / 2**20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Start-up time of the tools: importing them, and running --version, in new interpreters.
+
+Usage: python -m benchmarks.bench_import_time --runs 20
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ("python startup", "pass"),
+    ("import fetchtool.fetch_reads", "import fetchtool.fetch_reads"),
+    ("import fetchtool.fetch_assemblies", "import fetchtool.fetch_assemblies"),
+    (
+        "fetch-read-tool --version",
+        "import sys; sys.argv = ['fetch-read-tool', '--version']; from fetchtool.fetch_reads import main; main()",
+    ),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    for label, code in COMMANDS:
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], stdout=subprocess.DEVNULL, check=False)
+            timings.append(time.perf_counter() - start)
+        print(f"{label:<36} median {statistics.median(timings) * 1000:8.1f} ms, min {min(timings) * 1000:8.1f} ms")
+
+    # the slowest imports, cumulative time in microseconds
+    importtime = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import fetchtool.fetch_reads"], capture_output=True, text=True
+    ).stderr.splitlines()[1:]
+    slowest = sorted(importtime, key=lambda line: int(line.split("|")[1]), reverse=True)[:10]
+    print("\n".join(["", "slowest imports of fetchtool.fetch_reads:"] + slowest))
+
+
+if __name__ == "__main__":
+    main()
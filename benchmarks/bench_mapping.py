@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-record against columnar mapping of a Portal API page.
+
+Usage: python -m benchmarks.bench_mapping --records 200000
+"""
+
+import argparse
+import tempfile
+
+from benchmarks.bench_records import synthetic_runs, timed
+from fetchtool.fetch_reads import FetchReads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fetch = FetchReads(argv=["-p", "ERP000001", "-d", tmpdir])
+        page = list(synthetic_runs(args.records))
+        # every tenth run only has its submitted files, renamed after the run accession
+        for record in page[::10]:
+            record["submitted_ftp"], record["submitted_md5"] = record["fastq_ftp"], record["fastq_md5"]
+            record["fastq_ftp"] = record["fastq_md5"] = ""
+        print(f"{args.records} synthetic runs")
+
+        scalar = timed("per-record mapping", lambda: [e for e in map(fetch._map_portal_record, page) if e], args.records)
+        columnar = timed("columnar mapping", lambda: fetch._map_portal_records_columnar(page), args.records)
+        assert scalar == columnar, "the columnar mapping differs from the per-record mapping"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory and throughput of the run entries for a synthetic study.
+
+Usage: python -m benchmarks.bench_records --records 200000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fetchtool.fetch_reads import FetchReads
+
+
+def synthetic_runs(count, study="ERP000001"):
+    """Portal API read_run records, paired-end fastq files"""
+    for i in range(count):
+        run = f"ERR{1000000 + i}"
+        ftp = f"ftp.sra.ebi.ac.uk/vol1/fastq/{run[:6]}/00{i % 10}/{run}/{run}"
+        yield {
+            "study_accession": "PRJEB00001",
+            "secondary_study_accession": study,
+            "sample_accession": f"SAMEA{i}",
+            "secondary_sample_accession": f"ERS{i}",
+            "experiment_accession": f"ERX{i}",
+            "run_accession": run,
+            "instrument_model": "Illumina HiSeq 2500",
+            "instrument_platform": "ILLUMINA",
+            "library_layout": "PAIRED",
+            "fastq_ftp": f"{ftp}_1.fastq.gz;{ftp}_2.fastq.gz",
+            "fastq_md5": f"{i:032x};{i + 1:032x}",
+            "submitted_ftp": "",
+            "submitted_md5": "",
+            "library_strategy": "WGS",
+            "broker_name": "",
+            "library_source": "METAGENOMIC",
+            "last_updated": "2024-01-01",
+        }
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.2f} s {count / elapsed:12.0f} entries/s")
+    return result
+
+
+def retained_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fetch = FetchReads(argv=["-p", "ERP000001", "-d", tmpdir])
+        fetch.runs = [f"ERR{1000000 + i}" for i in range(0, args.records, 2)]
+        page = list(synthetic_runs(args.records))
+        print(f"{args.records} synthetic runs")
+
+        _, entries = timed("map to entries", lambda: fetch._map_portal_pages([page]), args.records)
+        filtered = timed("filter by run accession", lambda: fetch.filter_by_accessions(entries), args.records)
+        timed("description file rows", lambda: [fetch.clean_data_row(fetch.map_project_info_to_row(e)) for e in filtered], len(filtered))
+        os.makedirs(fetch.get_project_workdir("ERP000001"))
+        timed("write project files", lambda: fetch.write_project_files("ERP000001", entries), args.records)
+
+        del entries, filtered
+        (_, entries), entries_size = retained_memory(lambda: fetch._map_portal_pages([page]))
+        # the values are shared by both models, the difference is the container
+        dicts = [e.to_dict() for e in entries]
+        print(f"{'memory, entries with values':<32} {entries_size / 2**20:8.1f} MiB")
+        print(f"{'memory, slotted containers':<32} {sum(map(sys.getsizeof, entries)) / 2**20:8.1f} MiB")
+        print(f"{'memory, dict containers':<32} {sum(map(sys.getsizeof, dicts)) / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,7 +16,6 @@
 
 
 import argparse
-import copy
 import ftplib
 import hashlib
 import json
@@ -25,16 +24,16 @@ import os
 import re
 import subprocess
 import sys
+import threading
+import time
+import zlib
 from abc import ABC, abstractmethod
-from importlib.metadata import version
-
-import boto3
-import pandas as pd
-import requests
-from botocore import UNSIGNED
-from botocore.config import Config
-from flufl.lock import Lock
-from pandas.errors import EmptyDataError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+
+from flufl.lock import Lock, TimeOutError
 from tenacity import (
     RetryError,
     before_log,
@@ -44,7 +43,19 @@ from tenacity import (
     wait_exponential,
 )
 
+from fetchtool import __version__
+from fetchtool.desc_file import (
+    FILL_VALUE,
+    UnmergeableDescriptionFile,
+    file_version,
+    read_description_rows,
+    write_description_file,
+)
 from fetchtool.exceptions import ENAFetch204, ENAFetch401, ENAFetchFail
+from fetchtool.snapshot import iter_snapshot_projects, read_snapshot_header, write_snapshot
+from fetchtool.state import FAILED, VERIFIED, ProjectState
+from fetchtool.work_queue import FAILED as WORK_QUEUE_FAILED
+from fetchtool.work_queue import LEASED, WorkQueue
 
 PRIVATE_ENA_FTP = "ftp.dcc-private.ebi.ac.uk"
 PUBLIC_ENA_FTP = "ftp.ebi.ac.uk"
@@ -71,15 +82,25 @@ class AbstractDataFetcher(ABC):
         "file_path",
     ]
     ACCESSION_FIELD = None
+    ENTRY_CLASS = None
     ACCESSION_REGEX = r"([EDS]R[RZS]\d+)"
+    ACCESSION_PATTERN = re.compile(ACCESSION_REGEX)
+    ENA_PORTAL_BULK_STUDY_QUERY = "secondary_study_accession=%22{0}%22"
+    ENA_PORTAL_UPDATED_CLAUSE = "%20AND%20last_updated%3E%3D{0}"
     PROGRAM_EXIT_MSG = "Program will exit now!"
     NO_DATA_MSG = "No entries found!"
 
-    def __init__(self, argv=sys.argv[1:]):
-        self.args = self._parse_args(argv)
-        self._validate_args()
-
-        self.set_logging(self.args.verbose)
+    def __init__(self, argv=sys.argv[1:], args=None, config=None):
+        """argv: the command line options
+        args: the parsed options, used instead of argv, see from_options
+        config: config values overriding the defaults and the config file
+        """
+        if args is None:
+            self.args = self._parse_args(argv)
+            self._validate_args()
+            self.set_logging(self.args.verbose)
+        else:
+            self.args = args
         self.create_output_dir(self.args.dir)
         self.base_dir = self.args.dir
 
@@ -89,6 +110,16 @@ class AbstractDataFetcher(ABC):
         self.desc_file_only = self.args.fix_desc_file
         self.ignore_errors = self.args.ignore_errors
         self.ebi = self.args.ebi
+        self.bulk_mode = self.args.bulk
+        self.incremental_mode = self.args.incremental
+        self.reconcile_mode = self.args.reconcile
+        self.snapshot_file = self.args.from_snapshot
+        self.state_mode = self.args.state_db
+        # the bytes assigned to each shard by --shard-by size, across the projects
+        self._shard_loads = [0] * self.args.shard[1] if self.args.shard else None
+        self._work_queue = None
+        # the state stores of the projects, by project directory
+        self._project_states = {}
 
         self.config = {}
         self._load_default_config_values()
@@ -100,15 +131,61 @@ class AbstractDataFetcher(ABC):
         else:
             with open(self.args.config_file or config_file) as f:
                 self.config = self.config | json.load(f)
+        if config:
+            self.config = self.config | config
 
         self.ENA_API_USER = self.config["ena_api_username"]
         self.ENA_API_PASSWORD = self.config["ena_api_password"]
 
+        # the connections reused across the downloads and the Portal API requests
+        self._connections_lock = threading.Lock()
+        self._http_session = None
+        self._ftp_connections = {}
+        self._s3_clients = {}
+
+        self.projects = None
         self._process_additional_args()
         if self.args.projects or self.args.project_list:
             self.projects = self._get_project_accessions(self.args)
             self.sanity_check_project_accessions()
 
+    @classmethod
+    def from_options(cls, config=None, **options):
+        """Create a fetcher without a command line, to use the tool as a library.
+        options: the command line options by their argparse names (dir, projects, private, force...),
+        the missing options have their command line default values.
+        config: config values overriding the defaults and the config file.
+        Logging isn't configured, and the projects can be given later to fetch_projects.
+        """
+        args = cls._build_parser().parse_args([])
+        unknown_options = set(options) - set(vars(args))
+        if unknown_options:
+            raise ValueError("Unknown options: " + ", ".join(sorted(unknown_options)))
+        vars(args).update(options)
+        return cls(args=args, config=config)
+
+    def close(self):
+        """Close the connections, the project state stores and the work queue"""
+        self.close_project_states()
+        if self._work_queue is not None:
+            self._work_queue.close()
+            self._work_queue = None
+        with self._connections_lock:
+            if self._http_session is not None:
+                self._http_session.close()
+                self._http_session = None
+            for connections in self._ftp_connections.values():
+                for ftp, _ in connections:
+                    ftp.close()
+            self._ftp_connections = {}
+            self._s3_clients = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     @abstractmethod
     def _validate_args(self):
         pass
@@ -133,6 +210,10 @@ class AbstractDataFetcher(ABC):
         return data
 
     def _parse_args(self, argv):
+        return self._build_parser().parse_args(argv)
+
+    @classmethod
+    def _build_parser(cls):
         parser = argparse.ArgumentParser()
         project_args = parser.add_mutually_exclusive_group()
         project_args.add_argument(
@@ -144,7 +225,7 @@ class AbstractDataFetcher(ABC):
         project_args.add_argument("-l", "--project-list", help="File containing line-separated project list")
         parser.add_argument("-d", "--dir", help="Base directory for downloads", default=os.getcwd())
         parser.add_argument("-v", "--verbose", help="Verbose", action="count")
-        parser.add_argument("--version", help="Version", action="version", version=version("fetch-tool"))
+        parser.add_argument("--version", help="Version", action="version", version=__version__)
         parser.add_argument(
             "-f",
             "--force",
@@ -170,14 +251,72 @@ class AbstractDataFetcher(ABC):
             action="store_true",
         )
         parser.add_argument("-e", "--ebi", required=False, help="Set this flag when running on EBI infrastructure", action="store_true")
-        parser = self.add_arguments(parser)
-        return parser.parse_args(argv)
+        parser.add_argument(
+            "--bulk",
+            help="Query the metadata of several projects per Portal API request, useful for long project lists",
+            action="store_true",
+        )
+        sync_args = parser.add_mutually_exclusive_group()
+        sync_args.add_argument(
+            "--incremental",
+            help="Only fetch the entries updated in ENA since the last successful sync of each project",
+            action="store_true",
+        )
+        sync_args.add_argument(
+            "--reconcile",
+            help="Full sync that only downloads the files missing from the raw directory, without checking the MD5 of the "
+            "existing files. It also resets the last sync mark used by --incremental",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--state-db",
+            help="Keep the state of each project (entries, files, MD5s) in a SQLite database in the project directory. "
+            "The project description file is generated from it, and the MD5 of the files that didn't change isn't computed again",
+            action="store_true",
+        )
+        distribution_args = parser.add_mutually_exclusive_group()
+        distribution_args.add_argument(
+            "--shard",
+            help="Only download the share I of N of the files (1 <= I <= N), to split a fetch across N jobs. "
+            "The project files are still written by all the jobs",
+            type=_shard_arg,
+        )
+        distribution_args.add_argument(
+            "--work-queue",
+            help="SQLite work queue on a shared filesystem, the jobs started with the same queue share the downloads, "
+            "each job downloads the next file of the queue until all the files are downloaded",
+        )
+        parser.add_argument(
+            "--shard-by",
+            help="Split the work by run/assembly accession or by file name, with a stable hash, "
+            "or by size: the runs/assemblies are balanced on their file sizes, "
+            "all the jobs need the same metadata, use a snapshot (default: run)",
+            choices=["run", "file", "size"],
+            default="run",
+        )
+        snapshot_args = parser.add_mutually_exclusive_group()
+        snapshot_args.add_argument(
+            "--export-snapshot",
+            help="Save the metadata of the projects to a snapshot file (.gz to compress it), without downloading the data",
+        )
+        snapshot_args.add_argument(
+            "--from-snapshot",
+            help="Fetch the data using the metadata from a snapshot file, without querying the Portal API. "
+            "All the projects of the snapshot are fetched if no projects are specified",
+        )
+        return cls.add_arguments(parser)
 
     def _load_default_config_values(self):
         """Load the default values in the config object"""
         self.config["ena_api_username"] = ""
         self.config["ena_api_password"] = ""
         self.config["url_max_attempts"] = 5
+        self.config["portal_page_size"] = 10000
+        self.config["portal_page_workers"] = 4
+        self.config["bulk_query_size"] = 50
+        self.config["columnar_mapping_threshold"] = 0
+        self.config["work_queue_lease"] = 300
+        self.config["work_queue_max_attempts"] = 3
         self.config["fire_endpoint"] = "https://hl.fire.sdo.ebi.ac.uk"
         self.config["fire_ena_bucket"] = "era-private" if self.private_mode else "era-public"
         self.config["fire_access_key_id"] = ""
@@ -211,28 +350,131 @@ class AbstractDataFetcher(ABC):
     def _retrieve_project_info_from_api(self, project_accession):
         pass
 
+    @abstractmethod
+    def _get_bulk_portal_url(self, project_accessions, since=None):
+        """Portal API search url for the entries of all the projects.
+        since: optional dict with the last_updated date from which to query each project
+        """
+        pass
+
+    def _get_bulk_study_query(self, project_accession, since=None):
+        query = self.ENA_PORTAL_BULK_STUDY_QUERY.format(project_accession)
+        if since:
+            query = "%28" + query + self.ENA_PORTAL_UPDATED_CLAUSE.format(since) + "%29"
+        return query
+
+    @abstractmethod
+    def _map_portal_record(self, data):
+        """Map one Portal API record, returns None if the record has no usable files"""
+        pass
+
     @abstractmethod
     def _filter_accessions_from_args(self, data, fieldname):
         pass
 
     def fetch(self):
-        for project_accession in self.projects:
-            self.fetch_project(project_accession)
+        if self.args.export_snapshot:
+            self.export_snapshot(self.args.export_snapshot)
+            return
+        if self.snapshot_file:
+            projects = self.read_snapshot(self.snapshot_file)
+        else:
+            projects = self.retrieve_projects(self.projects)
+        self._fetch_projects(projects)
+
+    def fetch_projects(self, project_accessions):
+        """Fetch the projects, the fetcher can be used for several calls with its connections kept open"""
+        project_accessions = list(project_accessions)
+        invalid_accessions = [p for p in project_accessions if not self.is_study_accession(p)]
+        if invalid_accessions:
+            raise ValueError("Invalid study accessions: " + ", ".join(invalid_accessions))
+        self.projects = project_accessions
+        self._fetch_projects(self.retrieve_projects(project_accessions))
+
+    def _fetch_projects(self, projects):
+        try:
+            for project_accession, new_data in projects:
+                self.fetch_project(project_accession, new_data)
+            if self.args.work_queue and not self.desc_file_only:
+                self.process_work_queue(wait=True)
+        finally:
+            self.close_project_states()
+
+    def retrieve_projects(self, project_accessions):
+        """Yields the project accessions with their entries, an empty list if none could be retrieved.
+        In bulk mode the metadata of bulk_query_size projects is retrieved per Portal API query,
+        projects missing from the bulk results go through the per project query, and its fallbacks.
+        """
+        if not self.bulk_mode:
+            for project_accession in project_accessions:
+                yield project_accession, self.retrieve_project(project_accession) or []
+            return
+
+        project_accessions = list(project_accessions)
+        chunk_size = max(1, self.config["bulk_query_size"])
+        for i in range(0, len(project_accessions), chunk_size):
+            chunk = project_accessions[i : i + chunk_size]
+            since = {}
+            if self.incremental_mode:
+                since = {p: self.get_project_sync_mark(p) for p in chunk}
+            projects_data = self._retrieve_bulk_project_info_from_api(chunk, since)
+            for project_accession in chunk:
+                if project_accession in projects_data:
+                    yield project_accession, projects_data[project_accession]
+                elif since.get(project_accession):
+                    logging.info(f"No entries updated since {since[project_accession]} for project {project_accession}")
+                    yield project_accession, []
+                else:
+                    yield project_accession, self.retrieve_project(project_accession) or []
+
+    def _get_snapshot_header(self):
+        return {"fetcher": type(self).__name__, "scope": self._get_sync_scope()}
+
+    def export_snapshot(self, filename):
+        """Save the entries of the projects, as returned by the Portal API mapping, to a snapshot file"""
+        projects = ((p, [e.to_dict() for e in entries]) for p, entries in self.retrieve_projects(self.projects))
+        count = write_snapshot(filename, self._get_snapshot_header(), projects)
+        logging.info(f"Saved the metadata of {count} projects to the snapshot {filename}")
+
+    def read_snapshot(self, filename):
+        """Yields the projects of the snapshot with their entries, restricted to the requested projects if any"""
+        header = read_snapshot_header(filename)
+        if header.get("fetcher") != type(self).__name__:
+            raise ValueError(f"The snapshot {filename} was created by {header.get('fetcher')}, not {type(self).__name__}")
+        if header.get("scope") != self._get_sync_scope():
+            logging.warning(f"The snapshot {filename} was created for {header.get('scope')}, not {self._get_sync_scope()}")
+        projects = set(self.projects) if self.projects else None
+        for project_accession, entries in iter_snapshot_projects(filename):
+            if projects is None or project_accession in projects:
+                yield project_accession, [self.ENTRY_CLASS.from_dict(e) for e in entries]
 
     def filter_by_accessions(self, new_data):
         if not self.force_mode:
             new_data = self._filter_accessions_from_args(new_data, self.ACCESSION_FIELD)
         return new_data
 
-    def fetch_project(self, project_accession):
-        new_data = self.retrieve_project(project_accession)
+    def fetch_project(self, project_accession, new_data=None):
+        if new_data is None:
+            new_data = self.retrieve_project(project_accession)
         if not new_data:  # exit function if there is no data and skip to the next study
             return
+        # the sync mark is only moved when all the project entries are fetched
+        full_sync = not self.desc_file_only
         if not self.desc_file_only and not self.force_mode:
             logging.info("Filtering study entries...")
             logging.info("Number of entries before filtering: {}".format(len(new_data)))
+            entries_count = len(new_data)
             new_data = self.filter_by_accessions(new_data)
+            full_sync = len(new_data) == entries_count
             logging.info("Number of entries after filtering: {}.".format(len(new_data)))
+        download_data = new_data
+        if self.args.shard and not self.desc_file_only:
+            download_data = self.shard_entries(new_data)
+            # the entries with files in the shard, the other jobs write the other entries
+            shard_accessions = {e[self.ACCESSION_FIELD] for e in download_data}
+            new_data = [e for e in new_data if e[self.ACCESSION_FIELD] in shard_accessions]
+            full_sync = False
+            logging.info("Number of entries in shard {}/{}: {}.".format(*self.args.shard, len(new_data)))
         if len(new_data) == 0:
             logging.warning(self.NO_DATA_MSG)
             return
@@ -243,15 +485,134 @@ class AbstractDataFetcher(ABC):
         self.write_project_files(secondary_project_accession, new_data)
 
         if not self.desc_file_only:
-            self.download_raw_files(project_accession, new_data)
+            if self.args.work_queue:
+                # the files are downloaded by any of the jobs of the queue, the sync mark isn't moved
+                self.add_work_queue_items(project_accession, download_data)
+                self.process_work_queue()
+            else:
+                downloaded = self.download_raw_files(project_accession, download_data)
+                if downloaded and full_sync:
+                    self.write_project_sync_mark(project_accession, new_data)
+            # skipped if another job is compacting the manifest
+            self.compact_project_download_file(secondary_project_accession, timeout=1)
+
+    def shard_entries(self, entries):
+        """The entries of the shard I of N (--shard), entries are split by accession or balanced on their size,
+        with --shard-by file the entries only keep the files of the shard.
+        """
+        index, count = self.args.shard
+        if self.args.shard_by == "file":
+            shard_entries = []
+            for entry in entries:
+                kept = [i for i, name in enumerate(entry["file"]) if _shard_of(name, count) == index]
+                if len(kept) == len(entry["file"]):
+                    shard_entries.append(entry)
+                elif kept:
+                    data = entry.to_dict()
+                    for key in ["DATA_FILE_PATH", "file", "MD5", "FILE_SIZE"]:
+                        # the MD5s and sizes are aligned with the files, if they're known
+                        if len(data[key]) == len(entry["file"]):
+                            data[key] = tuple(data[key][i] for i in kept)
+                    shard_entries.append(type(entry).from_dict(data))
+            return shard_entries
+        if self.args.shard_by == "run":
+            return [e for e in entries if _shard_of(e[self.ACCESSION_FIELD], count) == index]
+        # longest first on the least loaded shard, the entries without sizes are hashed
+        shard_entries = []
+        sized_entries = []
+        for entry in entries:
+            sizes = entry.get("FILE_SIZE") or ()
+            if sizes and None not in sizes:
+                sized_entries.append((-sum(sizes), entry[self.ACCESSION_FIELD], entry))
+            elif _shard_of(entry[self.ACCESSION_FIELD], count) == index:
+                shard_entries.append(entry)
+        for negative_size, _, entry in sorted(sized_entries, key=lambda e: e[:2]):
+            shard = min(range(count), key=self._shard_loads.__getitem__)
+            self._shard_loads[shard] -= negative_size
+            if shard + 1 == index:
+                shard_entries.append(entry)
+        return shard_entries
+
+    def get_work_queue(self):
+        if self._work_queue is None:
+            self._work_queue = WorkQueue(
+                self.args.work_queue, lease=self.config["work_queue_lease"], max_attempts=self.config["work_queue_max_attempts"]
+            )
+        return self._work_queue
+
+    def add_work_queue_items(self, project_accession, entries):
+        """Add the files of the entries to the work queue, the files already queued by other jobs are kept"""
+        items = []
+        for entry in entries:
+            sizes = entry.get("FILE_SIZE") or [None] * len(entry["file"])
+            for url, filename, size in zip(entry["DATA_FILE_PATH"], entry["file"], sizes):
+                data = {"project": project_accession, "url": url, "file": filename, "md5": list(entry["MD5"])}
+                items.append((f"{project_accession}/{filename}", data, size))
+        self.get_work_queue().add_items(items)
+
+    def process_work_queue(self, wait=False):
+        """Download the files claimed from the work queue, largest first, until there are no files left to claim.
+        wait: wait for the files claimed by the other jobs, they're claimed again if their job dies
+        Returns false if some files failed.
+        """
+        queue = self.get_work_queue()
+        queue.start_heartbeat()
+        try:
+            while True:
+                item = queue.claim()
+                if item is None:
+                    if not wait or not queue.get_state_counts().get(LEASED):
+                        break
+                    time.sleep(min(queue.lease / 3, 10))
+                    continue
+                key, data = item
+                queue.complete(key, self._download_work_queue_item(data))
+        finally:
+            queue.stop_heartbeat()
+        counts = queue.get_state_counts()
+        logging.info("Work queue: " + ", ".join(f"{count} {state}" for state, count in sorted(counts.items())))
+        if wait and counts.get(WORK_QUEUE_FAILED):
+            msg = "{} files of the work queue failed".format(counts[WORK_QUEUE_FAILED])
+            if not self.ignore_errors:
+                raise EnvironmentError(msg)
+            logging.error(msg)
+        return not counts.get(WORK_QUEUE_FAILED)
+
+    def _download_work_queue_item(self, data):
+        raw_dir = self.get_project_rawdir(data["project"])
+        os.makedirs(raw_dir, exist_ok=True)
+        try:
+            return self.download_raw_file(data["url"], os.path.join(raw_dir, data["file"]), data["md5"])
+        except (RetryError, EnvironmentError) as e:
+            logging.error(f"Failed to download file {data['url']}: {e}")
+            return False
 
     def retrieve_project(self, project_accession):
         new_runs = self._retrieve_project_info_from_api(project_accession)
         return new_runs
 
+    def _retrieve_bulk_project_info_from_api(self, project_accessions, since=None):
+        """Retrieve the entries of several projects with one OR-combined Portal API query.
+        Returns the mapped entries keyed by project, projects without results are not included.
+        """
+        projects_data = {}
+        try:
+            for page in self._retrieve_ena_url_pages(self._get_bulk_portal_url(project_accessions, since), raise_on_204=False):
+                for record in page:
+                    projects_data.setdefault(record["secondary_study_accession"], [])
+                for entry in self._map_portal_page(page):
+                    projects_data[entry["STUDY_ID"]].append(entry)
+        except ENAFetchFail as ex:
+            logging.error(ex)
+            return {}
+        logging.info("Retrieved entries for {} of {} projects with a bulk query".format(len(projects_data), len(project_accessions)))
+        return projects_data
+
     def download_raw_files(self, project_accession, new_runs):
+        """Returns true if all the files were downloaded"""
         raw_dir = self.get_project_rawdir(project_accession)
         os.makedirs(raw_dir, exist_ok=True)
+        downloaded = True
         for run in new_runs:
             download_sources = run["DATA_FILE_PATH"]
             filenames = run["file"]
@@ -264,6 +625,8 @@ class AbstractDataFetcher(ABC):
                     logging.error(f"Failed to download file {dl_file}.")
                     if not self.ignore_errors:
                         raise
+                    downloaded = False
+        return downloaded
 
     @retry(
         retry=retry_if_result(is_false),
@@ -277,6 +640,9 @@ class AbstractDataFetcher(ABC):
         """
         filename = os.path.basename(dest)
         file_downloaded = False
+        if self.reconcile_mode and not self.force_mode and os.path.exists(dest):
+            logging.info("File {} already exists, skipping download".format(filename))
+            return True
         if not self._is_file_valid(dest, dl_md5s) or self.force_mode:
             silent_remove(dest)
             try:
@@ -324,16 +690,58 @@ class AbstractDataFetcher(ABC):
     def get_project_insdc_txt_file(self, project_accession):
         return os.path.join(self.get_project_workdir(project_accession), project_accession + "insdc.txt")
 
+    def get_project_sync_file(self, project_accession):
+        return os.path.join(self.get_project_workdir(project_accession), ".sync.json")
+
+    def _get_sync_scope(self):
+        """Key of the sync marks, fetches that query different entries need their own mark"""
+        return type(self).__name__
+
+    def read_project_sync_marks(self, project_accession):
+        try:
+            with open(self.get_project_sync_file(project_accession)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get_project_sync_mark(self, project_accession):
+        """The last_updated date of the most recent entry of the last successful sync"""
+        return self.read_project_sync_marks(project_accession).get(self._get_sync_scope(), {}).get("last_updated")
+
+    def write_project_sync_mark(self, project_accession, new_rows):
+        last_updated = max((r.get("LAST_UPDATED") or "" for r in new_rows), default="")
+        if not last_updated:
+            return
+        sync_file = self.get_project_sync_file(project_accession)
+        scope = self._get_sync_scope()
+        with Lock(sync_file + ".lock", lifetime=60, default_timeout=60 * 10):
+            marks = self.read_project_sync_marks(project_accession)
+            if not self.reconcile_mode:
+                last_updated = max(last_updated, marks.get(scope, {}).get("last_updated") or "")
+            marks[scope] = {"last_updated": last_updated}
+            with open(sync_file + ".tmp", "w") as f:
+                json.dump(marks, f, indent=2)
+            os.replace(sync_file + ".tmp", sync_file)
+
     def read_download_data(self, project_accession):
+        """The rows of the download manifest, sorted and without duplicates"""
         filepath = self.get_project_download_file(project_accession)
         with open(filepath) as f:
-            return f.readlines()
+            return self._sorted_download_rows(f)
+
+    @staticmethod
+    def _sorted_download_rows(lines):
+        return sorted({line if line.endswith("\n") else line + "\n" for line in lines if line.strip()})
 
     @staticmethod
     def create_empty_file(filepath):
         open(filepath, "a").close()
 
     def write_project_download_file(self, project_accession, new_rows):
+        """Append the new rows to the download manifest, with a single O_APPEND write and without locking.
+        The manifest is sorted and deduplicated on read and by compact_project_download_file. If the
+        manifest is compacted while the rows are written, they are appended again to the new file.
+        """
         new_download_rows = []
         for run in new_rows:
             for file_path, file in zip(run["file_path"], run["file"]):
@@ -344,39 +752,75 @@ class AbstractDataFetcher(ABC):
         if not os.path.isfile(download_file):
             self.create_empty_file(download_file)
 
-        lock_file = download_file + ".lock"
-        # Lock for 1 minute, timeout after 10 minutes to avoid deadlocking the code if it can't get the lock
-        with Lock(lock_file, lifetime=60, default_timeout=60 * 10):
-            existing_rows = set(self.read_download_data(project_accession))
-            existing_rows = existing_rows.union(set(new_download_rows))
-            with open(download_file, "w+") as f:
-                f.writelines(sorted(existing_rows))
+        data = "".join(new_download_rows).encode()
+        while data:
+            fd = os.open(download_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                os.write(fd, data)
+                inode = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            try:
+                if os.stat(download_file).st_ino == inode:
+                    break
+            except FileNotFoundError:
+                pass
+
+    def compact_project_download_file(self, project_accession, timeout=60 * 10):
+        """Sort the download manifest and remove the duplicated rows.
+        Returns False if the lock isn't acquired within timeout seconds.
+        """
+        download_file = self.get_project_download_file(project_accession)
+        lock = Lock(download_file + ".lock", lifetime=60)
+        try:
+            lock.lock(timeout=timeout)
+        except TimeOutError:
+            return False
+        try:
+            with open(download_file) as f:
+                state = self.get_project_state(project_accession)
+                rows = self._sorted_download_rows(chain(f, state.get_download_rows() if state else []))
+                with open(download_file + ".tmp", "w") as tmp:
+                    tmp.writelines(rows)
+                os.replace(download_file + ".tmp", download_file)
+                # rows appended to the old file while it was compacted
+                tail = f.read()
+            if tail:
+                with open(download_file, "a") as f:
+                    f.write(tail)
+        except FileNotFoundError:
+            pass
+        finally:
+            lock.unlock()
+        return True
 
     def get_project_filepath(self, project_accession):
         return os.path.join(self.get_project_workdir(project_accession), project_accession + ".txt")
 
     def read_project_description_file(self, project_accession):
+        import pandas as pd
+
         filepath = self.get_project_filepath(project_accession)
         return pd.read_csv(filepath, sep="\t")
 
     @staticmethod
     def clean_data_row(data):
-        clean_data = copy.deepcopy(data)
+        # the file lists are joined into new strings, a shallow copy is enough
+        clean_data = dict(data)
         for field in ["file", "file_path"]:
             clean_data[field] = ";".join(clean_data[field])
         return clean_data
 
     def get_downloaded_raw_file_accessions(self, project_accession):
-        raw_dir = self.get_project_rawdir(project_accession)
+        state = self.get_project_state(project_accession)
+        if state is not None:
+            return state.get_accessions()
+        search = self.ACCESSION_PATTERN.search
         try:
-            files = filter(
-                len,
-                map(lambda r: re.findall(self.ACCESSION_REGEX, r), os.listdir(raw_dir)),
-            )
-            accessions = {f[0] for f in list(files)}
+            with os.scandir(self.get_project_rawdir(project_accession)) as entries:
+                return {match.group(0) for match in map(search, (e.name for e in entries)) if match}
         except FileNotFoundError:
-            accessions = set()
-        return accessions
+            return set()
 
     def generate_expected_desc_data(self, project_accession, existing_data, project_data):
         accessions = self.get_downloaded_raw_file_accessions(project_accession)
@@ -407,8 +851,58 @@ class AbstractDataFetcher(ABC):
                 df[h] = None
         return df
 
+    # the number of merges done outside of the lock before merging with the lock held
+    DESC_FILE_MERGE_ATTEMPTS = 3
+    DESC_FILE_KEY_HEADERS = ["run_id", "analysis_id"]
+
     def write_project_description_file(self, project_accession, new_rows):
-        project_data = list(map(self.clean_data_row, new_rows))
+        """Merge the new rows into the project description file.
+        The rows are merged into a copy of the file without holding the lock, the lock is only held to
+        check that nobody changed the file in the meantime and to rename the copy. Description files
+        that can't be merged line by line are rewritten with pandas.
+        In --fix-desc-file mode only the rows of the downloaded runs/assemblies, or of the ones already
+        in the description file, are merged.
+        """
+        try:
+            if self.desc_file_only:
+                merged_rows = self.filter_expected_desc_rows(project_accession, new_rows)
+            else:
+                merged_rows = new_rows
+            self._merge_project_description_file(project_accession, list(map(self.clean_data_row, merged_rows)))
+        except UnmergeableDescriptionFile as e:
+            logging.debug("Rewriting the description file of {}: {}".format(project_accession, e))
+            self._rewrite_project_description_file(project_accession, list(map(self.clean_data_row, new_rows)))
+
+    def filter_expected_desc_rows(self, project_accession, project_data):
+        """Streaming version of generate_expected_desc_data, the description file isn't loaded in memory"""
+        accessions = self.get_downloaded_raw_file_accessions(project_accession)
+        for keys in read_description_rows(self.get_project_filepath(project_accession), self.DESC_FILE_KEY_HEADERS):
+            accessions.update(keys)
+        return [r for r in project_data if (r.get("run_id") or r["analysis_id"]) in accessions]
+
+    def _merge_project_description_file(self, project_accession, project_data):
+        project_file = self.get_project_filepath(project_accession)
+        for attempt in range(self.DESC_FILE_MERGE_ATTEMPTS + 1):
+            locked = attempt == self.DESC_FILE_MERGE_ATTEMPTS
+            lock = Lock(project_file + ".lock", lifetime=120, default_timeout=60 * 10)
+            if locked:
+                lock.lock()
+            try:
+                version = file_version(project_file)
+                tmp_file = write_description_file(project_file, self.DEFAULT_HEADERS, self.DESC_FILE_KEY_HEADERS, project_data)
+                if not locked:
+                    lock.lock()
+                if file_version(project_file) == version:
+                    os.replace(tmp_file, project_file)
+                    return
+                os.remove(tmp_file)
+            finally:
+                if lock.is_locked:
+                    lock.unlock()
+
+    def _rewrite_project_description_file(self, project_accession, project_data):
+        import pandas as pd
+        from pandas.errors import EmptyDataError
 
         project_file = self.get_project_filepath(project_accession)
 
@@ -441,6 +935,9 @@ class AbstractDataFetcher(ABC):
     def _is_rawdata_filetype(filename):
         return any(x in filename for x in [".fa", ".fna", ".fasta", ".fq", "fastq"])
 
+    # _is_rawdata_filetype as a regex, for the columnar mapping
+    RAWDATA_FILETYPE_PATTERN = r"\.fa|\.fna|\.fasta|\.fq|fastq"
+
     def _filter_secondary_files(self, joined_file_names, md5s):
         file_names = joined_file_names.split(";")
         md5s = md5s.split(";")
@@ -460,6 +957,12 @@ class AbstractDataFetcher(ABC):
         # print("file names:{}".format(file_names))
         return filepaths, file_names, md5s
 
+    @staticmethod
+    def _get_file_sizes(file_paths, portal_file_paths, portal_sizes):
+        """The sizes of the files, from the ;-separated Portal API file paths and sizes, None if unknown"""
+        sizes = dict(zip((portal_file_paths or "").split(";"), (portal_sizes or "").split(";")))
+        return tuple(int(sizes[f]) if sizes.get(f, "").isdigit() else None for f in file_paths)
+
     @staticmethod
     def _rename_raw_files(file_names, run_id):
         file_names = [f.lower() for f in file_names]
@@ -474,17 +977,81 @@ class AbstractDataFetcher(ABC):
         else:
             return [run_id + "_" + str(i + 1) + filetype for i, _ in enumerate(file_names)]
 
+    @staticmethod
+    def _portal_columns(records, fields):
+        """DataFrame of the fields of the Portal API records, missing fields are None.
+        Returns the DataFrame and a DataFrame of booleans, true for the non empty values
+        """
+        import pandas as pd
+
+        data = pd.DataFrame({field: [r.get(field) for r in records] for field in fields})
+        return data, data.notna() & (data != "")
+
+    # one or more ;-separated file names, all of them raw data files
+    RAWDATA_FILES_PATTERN = r"^(?:[^;]*(?:{0})[^;]*)(?:;[^;]*(?:{0})[^;]*)*$".format(RAWDATA_FILETYPE_PATTERN)
+
+    def _get_raw_filenames_columnar(self, filepaths, md5s, accessions, is_submitted_file):
+        """Columnar version of _get_raw_filenames.
+        filepaths, md5s, accessions and is_submitted_file are pandas Series with the same index,
+        filepaths and md5s must be non empty strings.
+        Returns a dict with the (file paths, file names, md5s) tuples by index, and a dict
+        that is true for the rows of the first dict where all the file basenames are raw data files.
+        The rows that need the per record logic are not in the dicts: files and md5s counts that
+        don't match, secondary files or unknown file formats.
+        """
+        if filepaths.empty:
+            return {}, {}
+        counts = filepaths.str.count(";") + 1
+        basenames = filepaths.str.replace(r"[^;]*/", "", regex=True)
+        rawdata_files = filepaths.str.contains(self.RAWDATA_FILES_PATTERN, regex=True)
+        lowered = filepaths.str.lower()
+        is_fastq = lowered.str.contains(".fastq", regex=False)
+        is_fasta = lowered.str.contains(r"\.fasta|\.fna|\.fa", regex=True)
+        rename = is_submitted_file | accessions.str.startswith("ERZ").fillna(False).astype(bool)
+        supported = (
+            (counts == md5s.str.count(";") + 1)
+            & accessions.map(lambda a: isinstance(a, str)).astype(bool)
+            & rawdata_files
+            & (~rename | is_fastq | is_fasta)
+        )
+        rawdata_basenames = basenames.str.contains(self.RAWDATA_FILES_PATTERN, regex=True)[supported]
+
+        raw_filenames = {}
+        for index, paths, names, md5, accession, count, renamed, fastq in zip(
+            filepaths.index[supported],
+            filepaths[supported].tolist(),
+            basenames[supported].tolist(),
+            md5s[supported].tolist(),
+            accessions[supported].tolist(),
+            counts[supported].tolist(),
+            rename[supported].tolist(),
+            is_fastq[supported].tolist(),
+        ):
+            if renamed:
+                extension = ".fastq.gz" if fastq else ".fasta.gz"
+                if count == 1:
+                    names = (accession + extension,)
+                else:
+                    names = tuple(f"{accession}_{i}{extension}" for i in range(1, count + 1))
+            else:
+                names = tuple(names.split(";"))
+            raw_filenames[index] = (tuple(paths.split(";")), names, tuple(md5.split(";")))
+        return raw_filenames, dict(zip(rawdata_basenames.index, rawdata_basenames.tolist()))
+
     def _retrieve_ena_url(self, url, raise_on_204=True):
         """Request json from ENA
         raise_on_204: raise ENAFetch204 if the response status code i 204
         """
+        import requests
+
+        session = self._get_http_session()
         attempt = 0
         request_params = {"url": url}
         if self.private_mode:
             request_params["auth"] = (self.ENA_API_USER, self.ENA_API_PASSWORD)
         while attempt <= self.config["url_max_attempts"]:
             try:
-                response = requests.get(**request_params)
+                response = session.get(**request_params)
                 if response.status_code == 200:
                     return response.json()
                 if response.status_code == 204:
@@ -506,11 +1073,102 @@ class AbstractDataFetcher(ABC):
 
         raise ENAFetchFail(error_message)
 
+    def _get_http_session(self):
+        """The requests session shared by the Portal API requests, it keeps the connections open"""
+        import requests
+
+        with self._connections_lock:
+            if self._http_session is None:
+                self._http_session = requests.Session()
+            return self._http_session
+
     @staticmethod
-    def _is_file_valid(dest, file_md5):
+    def _paginate_url(url, limit, offset):
+        separator = "" if url.endswith("&") else "&"
+        return f"{url}{separator}limit={limit}&offset={offset}"
+
+    def _retrieve_ena_page(self, url, offset, raise_on_204):
+        """Request one page of results, pages past the end of the results are empty"""
+        page_url = self._paginate_url(url, self.config["portal_page_size"], offset)
+        if offset == 0:
+            return self._retrieve_ena_url(page_url, raise_on_204=raise_on_204)
+        try:
+            return self._retrieve_ena_url(page_url)
+        except ENAFetch204:
+            return None
+
+    def _retrieve_ena_url_pages(self, url, raise_on_204=True):
+        """Request the Portal API search results in limit/offset pages.
+        The pages are requested concurrently, up to portal_page_workers at a time, and are
+        yielded in order as they arrive. Each page is retried on its own by _retrieve_ena_url,
+        so a transient failure only costs that page.
+        Setting portal_page_size to 0 disables the pagination.
+        """
+        page_size = self.config["portal_page_size"]
+        if not page_size:
+            data = self._retrieve_ena_url(url, raise_on_204=raise_on_204)
+            if data:
+                yield data
+            return
+
+        workers = max(1, self.config["portal_page_workers"])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_offset = 0
+            for _ in range(workers):
+                pending.append(executor.submit(self._retrieve_ena_page, url, next_offset, raise_on_204))
+                next_offset += page_size
+            try:
+                while pending:
+                    page = pending.popleft().result()
+                    if page:
+                        yield page
+                    if not page or len(page) < page_size:
+                        break
+                    pending.append(executor.submit(self._retrieve_ena_page, url, next_offset, raise_on_204))
+                    next_offset += page_size
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _map_portal_pages(self, pages):
+        """Map the Portal API records page by page, as the pages are retrieved.
+        Returns the number of records retrieved and the list of mapped records.
+        """
+        count = 0
+        mapped_data = []
+        for page in pages:
+            count += len(page)
+            mapped_data.extend(self._map_portal_page(page))
+        return count, mapped_data
+
+    def _map_portal_page(self, page):
+        """Map a page of records, pages of columnar_mapping_threshold records or more are mapped in bulk.
+        The columnar mapping is disabled by default (threshold 0), see benchmarks/bench_mapping.py
+        """
+        threshold = self.config["columnar_mapping_threshold"]
+        if threshold and len(page) >= threshold:
+            return self._map_portal_records_columnar(page)
+        return [m for m in map(self._map_portal_record, page) if m]
+
+    def _map_portal_records_columnar(self, records):
+        """Map the records with pandas column operations, the result is the same as _map_portal_record.
+        The fetchers without a columnar implementation map the records one by one.
+        """
+        return [m for m in map(self._map_portal_record, records) if m]
+
+    def _is_file_valid(self, dest, file_md5):
         if os.path.exists(dest):
             basename = os.path.basename(dest)
-            if md5(dest) in file_md5:
+            state = self._get_file_project_state(dest)
+            if state is None:
+                file_valid = md5(dest) in file_md5
+            else:
+                stat = os.stat(dest)
+                dest_md5 = state.get_cached_md5(basename, stat.st_size, stat.st_mtime_ns) or md5(dest)
+                file_valid = dest_md5 in file_md5
+                state.set_file_status(basename, VERIFIED if file_valid else FAILED, dest_md5, stat.st_size, stat.st_mtime_ns)
+            if file_valid:
                 return True
             else:
                 logging.info("File {} exists, but MD5 does not match".format(basename))
@@ -579,14 +1237,8 @@ class AbstractDataFetcher(ABC):
         file_name = os.path.basename(url)
 
         try:
-            with ftplib.FTP(server, timeout=300) as ftp:
+            with self._ftp_connection(server) as ftp:
                 logging.info("Downloading file from FTP server..." + url)
-                if self.private_mode:
-                    logging.info("Logging in...")
-                    ftp.login(self.ENA_API_USER, self.ENA_API_PASSWORD)
-                else:
-                    logging.info("Logging as anonymous")
-                    ftp.login()
                 ftp.cwd(path)
                 logging.info("Getting the file...")
                 # store with the same name
@@ -598,12 +1250,53 @@ class AbstractDataFetcher(ABC):
             logging.error(e)
             return False
 
+    @contextmanager
+    def _ftp_connection(self, server):
+        """A logged in FTP connection, in its home directory.
+        The connection is kept open for the next downloads, unless it fails.
+        """
+        connection = None
+        with self._connections_lock:
+            if self._ftp_connections.get(server):
+                connection = self._ftp_connections[server].pop()
+        if connection is not None:
+            ftp, home = connection
+            try:
+                ftp.cwd(home)
+            except ftplib.all_errors:
+                ftp.close()
+                connection = None
+        if connection is None:
+            ftp = ftplib.FTP(server, timeout=300)
+            try:
+                if self.private_mode:
+                    logging.info("Logging in...")
+                    ftp.login(self.ENA_API_USER, self.ENA_API_PASSWORD)
+                else:
+                    logging.info("Logging as anonymous")
+                    ftp.login()
+                home = ftp.pwd()
+            except BaseException:
+                ftp.close()
+                raise
+        try:
+            yield ftp
+        except BaseException:
+            ftp.close()
+            raise
+        with self._connections_lock:
+            self._ftp_connections.setdefault(server, []).append((ftp, home))
+
     def download_fire(self, dest: str, url: str) -> bool:
         """Copy the file using the aws cli to access EBI Fire. Only works within EBI Network
         Usage example, to get file path and names from full FTP URL
         - url = ftp.sra.ebi.ac.uk/vol1/sequence/ERZ166/ERZ1669403/contig.fa.gz (ftp.dcc-private.ebi.ac.uk/vol1/ for private)
         - dest = destination path
         """
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.config import Config
+
         # Remove the public and private prefixes
         fire_path = url.replace("ftp.sra.ebi.ac.uk/vol1/", "").replace("ftp.dcc-private.ebi.ac.uk/vol1/", "")
         fire_endpoint = self.config["fire_endpoint"]
@@ -630,7 +1323,7 @@ class AbstractDataFetcher(ABC):
             else:
                 # Public endpoint calls are not verified
                 s3_args.update({"config": Config(signature_version=UNSIGNED)})
-            s3 = boto3.client("s3", **s3_args)
+            s3 = self._get_s3_client(boto3, s3_args)
             object_key = fire_path
             s3.download_file(ena_bucket_name, object_key, dest)
             logging.info("File downloaded successfully")
@@ -640,6 +1333,14 @@ class AbstractDataFetcher(ABC):
             return False
         return True
 
+    def _get_s3_client(self, boto3, s3_args):
+        """The S3 clients are thread safe, one is created per endpoint and credentials"""
+        key = (s3_args["endpoint_url"], s3_args.get("aws_access_key_id"))
+        with self._connections_lock:
+            if key not in self._s3_clients:
+                self._s3_clients[key] = boto3.client("s3", **s3_args)
+            return self._s3_clients[key]
+
     @staticmethod
     def get_md5_file(filename):
         return filename + ".md5"
@@ -657,13 +1358,78 @@ class AbstractDataFetcher(ABC):
         with open(md5_dest, "w+") as f:
             f.write(md5_val)
 
+    def get_project_state_file(self, project_accession):
+        return os.path.join(self.get_project_workdir(project_accession), "state.sqlite")
+
+    def get_project_state(self, project_accession):
+        """The state store of the project, None without --state-db.
+        A new store is filled with the existing description file and raw files of the project.
+        """
+        if not self.state_mode:
+            return None
+        workdir = self.get_project_workdir(project_accession)
+        if workdir not in self._project_states:
+            state = ProjectState(self.get_project_state_file(project_accession))
+            if state.created:
+                self._import_project_state(project_accession, state)
+            self._project_states[workdir] = state
+        return self._project_states[workdir]
+
+    def _get_file_project_state(self, filename):
+        """The state store of the project of a raw file, if it's open"""
+        return self._project_states.get(os.path.dirname(os.path.dirname(os.path.abspath(filename))))
+
+    def close_project_states(self):
+        for state in self._project_states.values():
+            state.close()
+        self._project_states = {}
+
+    def _import_project_state(self, project_accession, state):
+        accession_field = self.ACCESSION_FIELD.lower()
+        rows = []
+        try:
+            for values in read_description_rows(self.get_project_filepath(project_accession), self.DEFAULT_HEADERS):
+                row = {h: None if v == FILL_VALUE else v for h, v in zip(self.DEFAULT_HEADERS, values)}
+                if row[accession_field]:
+                    row["file"] = (row["file"] or "").split(";")
+                    row["file_path"] = (row["file_path"] or "").split(";")
+                    rows.append(row)
+        except UnmergeableDescriptionFile as e:
+            logging.warning("The description file isn't imported in the state store: {}".format(e))
+        state.add_entries(rows, accession_field)
+        state.add_files([(n, r[accession_field], p, None) for r in rows for p, n in zip(r["file_path"], r["file"])])
+        try:
+            with os.scandir(self.get_project_rawdir(project_accession)) as entries:
+                raw_files = [e.name for e in entries if e.is_file()]
+        except FileNotFoundError:
+            raw_files = []
+        matches = map(self.ACCESSION_PATTERN.search, raw_files)
+        state.add_present_files([(name, match and match.group(0)) for name, match in zip(raw_files, matches)])
+        logging.info("Imported {} entries and {} raw files in the state store".format(len(rows), len(raw_files)))
+
+    def add_project_state_entries(self, state, new_runs, new_run_rows):
+        state.add_entries(new_run_rows, self.ACCESSION_FIELD.lower())
+        state.add_files(
+            [
+                (name, run[self.ACCESSION_FIELD], file_path, file_md5)
+                for run in new_runs
+                for file_path, name, file_md5 in zip(run["DATA_FILE_PATH"], run["file"], run["MD5"])
+            ]
+        )
+
     @abstractmethod
     def map_project_info_to_row(self, data):
         pass
 
     def write_project_files(self, project_accession, new_runs):
         new_run_rows = list(map(self.map_project_info_to_row, new_runs))
-        self.write_project_description_file(project_accession, new_run_rows)
+        state = self.get_project_state(project_accession)
+        if state is not None and not self.desc_file_only:
+            self.add_project_state_entries(state, new_runs, new_run_rows)
+            # the description file is generated from the state store
+            self.write_project_description_file(project_accession, state.get_rows())
+        else:
+            self.write_project_description_file(project_accession, new_run_rows)
         if not self.desc_file_only:
             self.write_project_download_file(project_accession, new_run_rows)
 
@@ -683,6 +1449,19 @@ class AbstractDataFetcher(ABC):
                 sys.exit(1)
 
 
+def _shard_arg(value):
+    """Parse a I/N shard, 1 <= I <= N"""
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard {value}, expected I/N with 1 <= I <= N")
+    return int(match.group(1)), int(match.group(2))
+
+
+def _shard_of(key, count):
+    """The shard, from 1 to count, of the accession or file name, the same on all the hosts"""
+    return zlib.crc32(key.encode()) % count + 1
+
+
 def silent_remove(filename):
     """Remove a file, if the file doesn't exist it will not raise an exception"""
     try:
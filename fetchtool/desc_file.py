@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming merge of the project description file.
+
+The description file is a TSV file sorted on (run_id, analysis_id), without duplicated keys.
+New rows are merged into it line by line, the output is the same as reading the file with
+pandas, concatenating the new rows, removing the duplicates (new rows win), filling the missing
+values with "n/a" and sorting. Files that aren't in that form raise UnmergeableDescriptionFile,
+the caller has to rewrite them.
+"""
+
+import csv
+import os
+import threading
+from operator import itemgetter
+
+FILL_VALUE = "n/a"
+
+# the strings that pandas.read_csv reads as missing values
+NA_VALUES = frozenset(
+    [
+        "",
+        "#N/A",
+        "#N/A N/A",
+        "#NA",
+        "-1.#IND",
+        "-1.#QNAN",
+        "-NaN",
+        "-nan",
+        "1.#IND",
+        "1.#QNAN",
+        "<NA>",
+        "N/A",
+        "NA",
+        "NULL",
+        "NaN",
+        "None",
+        "n/a",
+        "nan",
+        "null",
+    ]
+)
+# the missing values that aren't written as they are read
+_REPLACED_NA_VALUES = NA_VALUES - {FILL_VALUE}
+
+
+class UnmergeableDescriptionFile(Exception):
+    pass
+
+
+def file_version(path):
+    """Identifies the content of the file, None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def read_description_rows(path, headers):
+    """Yields the rows of a description file as tuples of the headers values, missing values are "n/a" """
+    try:
+        f = open(path, newline="")
+    except FileNotFoundError:
+        return
+    with f:
+        reader = csv.reader(f, delimiter="\t")
+        columns = next((r for r in reader if r), None)
+        if columns is None:
+            return
+        indexes = [columns.index(h) if h in columns else None for h in headers]
+        same_columns = columns == list(headers)
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(columns):
+                raise UnmergeableDescriptionFile(f"{path}: {len(row)} fields, expected {len(columns)}")
+            if same_columns and _REPLACED_NA_VALUES.isdisjoint(row):
+                yield tuple(row)
+            else:
+                yield tuple(FILL_VALUE if i is None or row[i] in NA_VALUES else row[i] for i in indexes)
+
+
+def new_description_rows(rows, headers, key_headers):
+    """The new rows as tuples of the headers values, sorted on the key and without duplicates (last wins)"""
+    get_key = itemgetter(*[headers.index(h) for h in key_headers])
+    new_rows = {}
+    for row in rows:
+        if FILL_VALUE in map(row.get, key_headers):
+            # a "n/a" key isn't the same as a missing key before the missing values are filled
+            raise UnmergeableDescriptionFile(f"{FILL_VALUE} in the key of {row}")
+        # NaN != NaN
+        values = tuple(
+            v if type(v) is str else FILL_VALUE if v is None or v != v else str(v) for v in map(row.get, headers)
+        )
+        key = get_key(values)
+        new_rows.pop(key, None)
+        new_rows[key] = values
+    return [new_rows[key] for key in sorted(new_rows)]
+
+
+def merge_description_rows(existing_rows, new_rows, key_indexes):
+    """Merge the sorted new rows into the existing rows, a new row replaces the existing row with the same key"""
+    get_key = itemgetter(*key_indexes)
+    new_rows = iter(new_rows)
+    new = next(new_rows, None)
+    new_key = new and get_key(new)
+    previous_key = None
+    for row in existing_rows:
+        key = get_key(row)
+        if previous_key is not None and key <= previous_key:
+            raise UnmergeableDescriptionFile(f"Unsorted or duplicated key {key}")
+        previous_key = key
+        if new is None or key < new_key:
+            yield row
+            continue
+        while new is not None and new_key < key:
+            yield new
+            new = next(new_rows, None)
+            new_key = new and get_key(new)
+        if new is not None and new_key == key:
+            yield new
+            new = next(new_rows, None)
+            new_key = new and get_key(new)
+        else:
+            yield row
+    if new is not None:
+        yield new
+        yield from new_rows
+
+
+def write_description_file(path, headers, key_headers, rows):
+    """Merge the rows into the description file in a temporary file.
+    Returns the temporary file, to be renamed to the description file.
+    """
+    key_indexes = [headers.index(h) for h in key_headers]
+    new_rows = new_description_rows(rows, headers, key_headers)
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator=os.linesep, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(headers)
+            writer.writerows(merge_description_rows(read_description_rows(path, headers), new_rows, key_indexes))
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return tmp_file
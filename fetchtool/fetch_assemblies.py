@@ -20,8 +20,10 @@ import logging
 import os
 import re
 
+
 from fetchtool.abstract_fetch import AbstractDataFetcher
 from fetchtool.exceptions import ENAFetch204, NoDataError
+from fetchtool.records import AssemblyEntry
 
 path_re = re.compile(r"(.*)/(.*)")
 
@@ -35,6 +37,7 @@ class Analysis(object):
 
 class FetchAssemblies(AbstractDataFetcher):
     ENA_PORTAL_BASE_API_URL = "https://www.ebi.ac.uk/ena/portal/api/search?"
+    ENTRY_CLASS = AssemblyEntry
 
     ENA_PORTAL_FIELDS = [
         "analysis_accession",
@@ -54,6 +57,7 @@ class FetchAssemblies(AbstractDataFetcher):
         "submitted_ftp",
         "generated_md5",
         "generated_ftp",
+        "generated_bytes",
         "sample_alias",
         "broker_name",
         "sample_title",
@@ -72,12 +76,21 @@ class FetchAssemblies(AbstractDataFetcher):
     ]
 
     # query
-    ENA_PORTAL_QUERY = (
-        "query=secondary_study_accession=%22{0}%22%20AND%20assembly_type=%22{1}%22"
-    )
-    ENA_PORTAL_RUN_QUERY = (
-        "query=analysis_accession=%22{0}%22%20AND%20assembly_type=%22{1}%22"
+    # {1} is the assembly type query, see _get_assembly_type_query
+    ENA_PORTAL_QUERY = "query=secondary_study_accession=%22{0}%22%20AND%20{1}"
+    ENA_PORTAL_UPDATED_QUERY = (
+        "query=secondary_study_accession=%22{0}%22%20AND%20{1}"
+        "%20AND%20last_updated%3E%3D{2}"
     )
+    ENA_PORTAL_RUN_QUERY = "query=analysis_accession=%22{0}%22%20AND%20{1}"
+    ENA_PORTAL_BULK_QUERY = "query=%28{0}%29%20AND%20{1}"
+    ENA_PORTAL_ASSEMBLY_TYPE_QUERY = "assembly_type=%22{0}%22"
+
+    ASSEMBLY_TYPES = [
+        "primary metagenome",
+        "binned metagenome",
+        "metatranscriptome",
+    ]
 
     ENA_PORTAL_API_URL = (
         ENA_PORTAL_BASE_API_URL
@@ -86,6 +99,13 @@ class FetchAssemblies(AbstractDataFetcher):
         + "&"
         + ENA_PORTAL_QUERY
     )
+    ENA_PORTAL_UPDATED_API_URL = (
+        ENA_PORTAL_BASE_API_URL
+        + "&".join(ENA_PORTAL_PARAMS)
+        + ",".join(ENA_PORTAL_FIELDS)
+        + "&"
+        + ENA_PORTAL_UPDATED_QUERY
+    )
     ENA_PORTAL_API_BY_RUN = (
         ENA_PORTAL_BASE_API_URL
         + "&".join(ENA_PORTAL_PARAMS)
@@ -94,6 +114,14 @@ class FetchAssemblies(AbstractDataFetcher):
         + ENA_PORTAL_RUN_QUERY
     )
 
+    ENA_PORTAL_BULK_API_URL = (
+        ENA_PORTAL_BASE_API_URL
+        + "&".join(ENA_PORTAL_PARAMS)
+        + ",".join(ENA_PORTAL_FIELDS)
+        + "&"
+        + ENA_PORTAL_BULK_QUERY
+    )
+
     ENA_FILEREPORT_URL = "https://www.ebi.ac.uk/ena/portal/api/filereport"
 
     # not in use
@@ -102,10 +130,10 @@ class FetchAssemblies(AbstractDataFetcher):
         "%22{0}%22&fields=study_accession,assembly_type,scientific_name,fasta_file&format=tsv"
     )
 
-    def __init__(self, argv=None):
+    def __init__(self, argv=None, args=None, config=None):
         self.ACCESSION_FIELD = "ANALYSIS_ID"
         self.assemblies = None
-        super().__init__(argv)
+        super().__init__(argv, args=args, config=config)
 
     @staticmethod
     def add_arguments(parser):
@@ -120,13 +148,11 @@ class FetchAssemblies(AbstractDataFetcher):
         # TODO: Also the older INSDC style metagenome assemblies produced by MGnify are not support that way at moment
         parser.add_argument(
             "--assembly-type",
-            help="Assembly type",
-            choices=[
-                "primary metagenome",
-                "binned metagenome",
-                "metatranscriptome",
-            ],
-            default="primary metagenome",
+            help="Assembly type(s), whitespace separated, or all. "
+            "The assemblies of all the types are retrieved with a single query per project",
+            nargs="+",
+            choices=FetchAssemblies.ASSEMBLY_TYPES + ["all"],
+            default=["primary metagenome"],
         )
         assembly_group.add_argument(
             "--assembly-list", help="File containing line-separated assembly accessions"
@@ -141,21 +167,30 @@ class FetchAssemblies(AbstractDataFetcher):
                 self.args.assembly_list,
                 self.args.projects,
                 self.args.project_list,
+                self.args.from_snapshot,
             ]
         ):
             raise ValueError(
-                "No data specified, please use -as, --assembly-list, -p or --project-list"
+                "No data specified, please use -as, --assembly-list, -p, --project-list or --from-snapshot"
             )
 
     def _process_additional_args(self):
-        self.assembly_type = self.args.assembly_type
+        if "all" in self.args.assembly_type:
+            self.assembly_types = list(self.ASSEMBLY_TYPES)
+        else:
+            self.assembly_types = sorted(set(self.args.assembly_type))
 
         if self.args.assembly_list:
             self.assemblies = self._read_line_sep_file(self.args.assembly_list)
         else:
             self.assemblies = self.args.assemblies
 
-        if not self.args.projects and not self.args.project_list:
+        if (
+            not self.args.projects
+            and not self.args.project_list
+            and not self.args.from_snapshot
+            and self.assemblies
+        ):
             logging.info("Fetching projects from list of assemblies")
             self.args.projects = self._get_project_accessions_from_assemblies(
                 self.assemblies
@@ -166,12 +201,27 @@ class FetchAssemblies(AbstractDataFetcher):
             False if len(self.projects) > 1 else True
         )  # allows script to continue to next project if one fails
 
-        data = None
+        since = None
+        portal_url = self.ENA_PORTAL_API_URL.format(
+            project_accession, self._get_assembly_type_query()
+        )
+        if self.incremental_mode:
+            since = self.get_project_sync_mark(project_accession)
+        if since:
+            portal_url = self.ENA_PORTAL_UPDATED_API_URL.format(
+                project_accession, self._get_assembly_type_query(), since
+            )
+
+        count = 0
+        mapped_data = []
         fetch_204_ex = None
         try:
-            data = self._retrieve_ena_url(
-                self.ENA_PORTAL_API_URL.format(project_accession, self.assembly_type),
-                raise_on_204=raise_error,
+            count, mapped_data = self._map_portal_pages(
+                self._retrieve_ena_url_pages(
+                    portal_url,
+                    # no results for an incremental query means no updates
+                    raise_on_204=raise_error and not since,
+                )
             )
         except ENAFetch204 as ex:
             logging.info(
@@ -198,8 +248,15 @@ class FetchAssemblies(AbstractDataFetcher):
                     f"It was not possible to fetch data from the Portal API or the Filereport API for project {project_accession}"
                 )
                 return
+            count, mapped_data = self._map_portal_pages([data])
+
+        if since and not count:
+            logging.info(
+                f"No assemblies updated since {since} for study {project_accession}"
+            )
+            return []
 
-        if not data:
+        if not count:
             logging.error(
                 f"It was not possible to fetch data from the Portal API for project {project_accession}"
             )
@@ -208,51 +265,107 @@ class FetchAssemblies(AbstractDataFetcher):
         logging.info(
             "Retrieved {count} assemblies for study {project_accession} from "
             "the ENA Portal API.".format(
-                count=len(data), project_accession=project_accession
+                count=count, project_accession=project_accession
             )
         )
-        mapped_data = []
-        for d in data:
-            if not d["generated_ftp"]:
-                logging.info(
-                    "The generated ftp location for assembly {} is not available yet".format(
-                        d["analysis_accession"]
-                    )
+        return mapped_data
+
+    def _get_assembly_type_query(self):
+        queries = [
+            self.ENA_PORTAL_ASSEMBLY_TYPE_QUERY.format(t) for t in self.assembly_types
+        ]
+        if len(queries) == 1:
+            return queries[0]
+        return "%28" + "%20OR%20".join(queries) + "%29"
+
+    def _get_bulk_portal_url(self, project_accessions, since=None):
+        since = since or {}
+        return self.ENA_PORTAL_BULK_API_URL.format(
+            "%20OR%20".join(
+                self._get_bulk_study_query(p, since.get(p)) for p in project_accessions
+            ),
+            self._get_assembly_type_query(),
+        )
+
+    def _map_portal_record(self, d):
+        if d.get("assembly_type") and d["assembly_type"] not in self.assembly_types:
+            # the filereport API doesn't filter by assembly type
+            return
+        if not d["generated_ftp"]:
+            logging.info(
+                "The generated ftp location for assembly {} is not available yet".format(
+                    d["analysis_accession"]
                 )
-            if d["analysis_type"] == "SEQUENCE_ASSEMBLY" and d["generated_ftp"]:
-                if self._is_rawdata_filetype(
-                    os.path.basename(d["generated_ftp"])
-                ):  # filter filenames not fasta
-                    raw_data_file_path, file_, md5_ = self._get_raw_filenames(
-                        d.get("generated_ftp"),
-                        d.get("generated_md5"),
-                        d.get("analysis_accession"),
-                        bool(d.get("submitted_ftp")),
-                    )
-                    mapped_data.append(
-                        {
-                            "STUDY_ID": d.get("secondary_study_accession"),
-                            "SAMPLE_ID": d.get("secondary_sample_accession"),
-                            "ANALYSIS_ID": d.get("analysis_accession"),
-                            "DATA_FILE_PATH": raw_data_file_path,
-                            "file": file_,
-                            "MD5": md5_,
-                        }
-                    )
+            )
+        if d["analysis_type"] == "SEQUENCE_ASSEMBLY" and d["generated_ftp"]:
+            if self._is_rawdata_filetype(
+                os.path.basename(d["generated_ftp"])
+            ):  # filter filenames not fasta
+                raw_data_file_path, file_, md5_ = self._get_raw_filenames(
+                    d.get("generated_ftp"),
+                    d.get("generated_md5"),
+                    d.get("analysis_accession"),
+                    bool(d.get("submitted_ftp")),
+                )
+                return self._new_entry(d, raw_data_file_path, file_, md5_)
+
+    def _map_portal_records_columnar(self, records):
+        data, non_empty = self._portal_columns(
+            records, ["generated_ftp", "generated_md5", "submitted_ftp", "analysis_type", "analysis_accession"]
+        )
+        generated_ftp = data["generated_ftp"]
+        candidates = non_empty["generated_ftp"] & non_empty["generated_md5"] & (data["analysis_type"] == "SEQUENCE_ASSEMBLY")
+        # filter filenames not fasta
+        candidates[candidates] = (
+            generated_ftp[candidates]
+            .str.rsplit("/", n=1)
+            .str[-1]
+            .str.contains(self.RAWDATA_FILETYPE_PATTERN, regex=True)
+        )
+        raw_filenames, _ = self._get_raw_filenames_columnar(
+            generated_ftp[candidates],
+            data["generated_md5"][candidates],
+            data["analysis_accession"][candidates],
+            non_empty["submitted_ftp"][candidates],
+        )
+        mapped_data = []
+        for index, d in zip(data.index, records):
+            if index not in raw_filenames:
+                mapped = self._map_portal_record(d)
+            elif d.get("assembly_type") and d["assembly_type"] not in self.assembly_types:
+                mapped = None
+            else:
+                mapped = self._new_entry(d, *raw_filenames[index])
+            if mapped:
+                mapped_data.append(mapped)
         return mapped_data
 
+    def _new_entry(self, d, raw_data_file_path, file_, md5_):
+        return AssemblyEntry(
+            study_id=d.get("secondary_study_accession"),
+            sample_id=d.get("secondary_sample_accession"),
+            analysis_id=d.get("analysis_accession"),
+            data_file_path=tuple(raw_data_file_path),
+            file=tuple(file_),
+            md5=tuple(md5_),
+            assembly_type=d.get("assembly_type"),
+            last_updated=d.get("last_updated"),
+            file_size=self._get_file_sizes(raw_data_file_path, d.get("generated_ftp"), d.get("generated_bytes")),
+        )
+
     def _filter_accessions_from_args(self, assembly_data, assembly_accession_field):
         if self.assemblies:
-            data = list(
-                filter(
-                    lambda r: (r[assembly_accession_field] in self.assemblies),
-                    assembly_data,
-                )
-            )
+            assemblies = set(self.assemblies)
+            data = [
+                r for r in assembly_data if r[assembly_accession_field] in assemblies
+            ]
             return data
         else:
             return assembly_data
 
+    def _get_sync_scope(self):
+        return f"{type(self).__name__}:{','.join(self.assembly_types)}"
+
     def map_project_info_to_row(self, assembly):
         return {
             "study_id": assembly["STUDY_ID"],
@@ -268,7 +381,9 @@ class FetchAssemblies(AbstractDataFetcher):
         project_list = set()
         for assembly in assemblies:
             data = self._retrieve_ena_url(
-                self.ENA_PORTAL_API_BY_RUN.format(assembly, self.assembly_type),
+                self.ENA_PORTAL_API_BY_RUN.format(
+                    assembly, self._get_assembly_type_query()
+                ),
                 raise_on_204=False,
             )
             if data:
@@ -277,6 +392,14 @@ class FetchAssemblies(AbstractDataFetcher):
             raise NoDataError(self.NO_DATA_MSG)
         return project_list
 
+    def fetch_assemblies(self, assemblies):
+        """Fetch the assemblies from their projects, the fetcher can be used for several calls"""
+        self.assemblies = list(assemblies)
+        try:
+            self.fetch_projects(sorted(self._get_project_accessions_from_assemblies(self.assemblies)))
+        finally:
+            self.assemblies = None
+
 
 def main():
     data_fetcher = FetchAssemblies()
@@ -19,14 +19,17 @@ import logging
 import os
 import re
 
+
 from fetchtool.abstract_fetch import AbstractDataFetcher
 from fetchtool.exceptions import ENAFetch204, NoDataError
+from fetchtool.records import RunEntry
 
 path_re = re.compile(r"(.*)/(.*)")
 
 
 class FetchReads(AbstractDataFetcher):
     ENA_PORTAL_BASE_API_URL = "https://www.ebi.ac.uk/ena/portal/api/search?"
+    ENTRY_CLASS = RunEntry
 
     ENA_PORTAL_FIELDS = [
         "study_accession",
@@ -40,11 +43,13 @@ class FetchReads(AbstractDataFetcher):
         "library_layout",
         "fastq_ftp",
         "fastq_md5",
+        "fastq_bytes",
         "submitted_ftp",
         "submitted_md5",
         "library_strategy",
         "broker_name",
         "library_source",
+        "last_updated",
     ]
 
     ENA_PORTAL_RUN_FIELDS = "secondary_study_accession"
@@ -60,7 +65,11 @@ class FetchReads(AbstractDataFetcher):
 
     # query
     ENA_PORTAL_QUERY = "query=secondary_study_accession=%22{0}%22&"
+    ENA_PORTAL_UPDATED_QUERY = (
+        "query=secondary_study_accession=%22{0}%22%20AND%20last_updated%3E%3D{1}&"
+    )
     ENA_PORTAL_RUN_QUERY = "query=run_accession=%22{0}%22"
+    ENA_PORTAL_BULK_QUERY = "query=%28{0}%29&"
 
     ENA_PORTAL_API_URL = (
         ENA_PORTAL_BASE_API_URL
@@ -69,6 +78,13 @@ class FetchReads(AbstractDataFetcher):
         + "&"
         + ENA_PORTAL_QUERY
     )
+    ENA_PORTAL_UPDATED_API_URL = (
+        ENA_PORTAL_BASE_API_URL
+        + "&".join(ENA_PORTAL_PARAMS)
+        + ",".join(ENA_PORTAL_FIELDS)
+        + "&"
+        + ENA_PORTAL_UPDATED_QUERY
+    )
     ENA_PORTAL_API_BY_RUN = (
         ENA_PORTAL_BASE_API_URL
         + "&".join(ENA_PORTAL_PARAMS)
@@ -77,12 +93,20 @@ class FetchReads(AbstractDataFetcher):
         + ENA_PORTAL_RUN_QUERY
     )
 
+    ENA_PORTAL_BULK_API_URL = (
+        ENA_PORTAL_BASE_API_URL
+        + "&".join(ENA_PORTAL_PARAMS)
+        + ",".join(ENA_PORTAL_FIELDS)
+        + "&"
+        + ENA_PORTAL_BULK_QUERY
+    )
+
     ENA_FILEREPORT_URL = "https://www.ebi.ac.uk/ena/portal/api/filereport"
 
-    def __init__(self, argv=None):
+    def __init__(self, argv=None, args=None, config=None):
         self.runs = None
         self.ACCESSION_FIELD = "RUN_ID"
-        super().__init__(argv)
+        super().__init__(argv, args=args, config=config)
 
     @staticmethod
     def add_arguments(parser):
@@ -105,10 +129,11 @@ class FetchReads(AbstractDataFetcher):
                 self.args.run_list,
                 self.args.projects,
                 self.args.project_list,
+                self.args.from_snapshot,
             ]
         ):
             raise ValueError(
-                "No data specified, please use -ru, --run-list, -p or --project-list"
+                "No data specified, please use -ru, --run-list, -p, --project-list or --from-snapshot"
             )
 
     def _process_additional_args(self):
@@ -117,7 +142,12 @@ class FetchReads(AbstractDataFetcher):
         else:
             self.runs = self.args.runs
 
-        if not self.args.projects and not self.args.project_list:
+        if (
+            not self.args.projects
+            and not self.args.project_list
+            and not self.args.from_snapshot
+            and self.runs
+        ):
             logging.info("Fetching projects from list of runs")
             self.args.projects = self._get_project_accessions_from_runs(self.runs)
 
@@ -128,12 +158,23 @@ class FetchReads(AbstractDataFetcher):
 
         used_api = "ENA Portal API"
 
-        data = None
+        since = None
+        portal_url = self.ENA_PORTAL_API_URL.format(project_accession)
+        if self.incremental_mode:
+            since = self.get_project_sync_mark(project_accession)
+        if since:
+            portal_url = self.ENA_PORTAL_UPDATED_API_URL.format(project_accession, since)
+
+        count = 0
+        mapped_data = []
         fetch_204_ex = None
         try:
-            data = self._retrieve_ena_url(
-                self.ENA_PORTAL_API_URL.format(project_accession),
-                raise_on_204=raise_error,
+            count, mapped_data = self._map_portal_pages(
+                self._retrieve_ena_url_pages(
+                    portal_url,
+                    # no results for an incremental query means no updates
+                    raise_on_204=raise_error and not since,
+                )
             )
         except ENAFetch204 as ex:
             logging.error(
@@ -161,64 +202,103 @@ class FetchReads(AbstractDataFetcher):
                     f"It was not possible to fetch data from the Portal API or the Filereport API for project {project_accession}"
                 )
                 return
+            count, mapped_data = self._map_portal_pages([data])
+
+        if since and not count:
+            logging.info(f"No runs updated since {since} for study {project_accession}")
+            return []
 
-        if not data:
+        if not count:
             logging.error(
                 f"It was not possible to fetch data from the Portal API for project {project_accession}"
             )
             return
 
         logging.info(
-            f"Retrieved {len(data)} runs for study {project_accession} from the {used_api}"
+            f"Retrieved {count} runs for study {project_accession} from the {used_api}"
         )
-        mapped_data = []
-        for d in data:
-            if not d["fastq_ftp"]:
-                logging.info(
-                    "The generated ftp location for the reads {} is not available yet".format(
-                        d["run_accession"]
-                    )
+        return mapped_data
+
+    def _get_bulk_portal_url(self, project_accessions, since=None):
+        since = since or {}
+        return self.ENA_PORTAL_BULK_API_URL.format(
+            "%20OR%20".join(
+                self._get_bulk_study_query(p, since.get(p)) for p in project_accessions
+            )
+        )
+
+    def _map_portal_record(self, d):
+        if not d["fastq_ftp"]:
+            logging.info(
+                "The generated ftp location for the reads {} is not available yet".format(
+                    d["run_accession"]
                 )
+            )
+            return
+        is_submitted_file = bool(d.get("submitted_ftp"))
+        file_paths = d.get("fastq_ftp")  # or rundata.get('submitted_ftp')??
+        is_valid_filetype = [
+            self._is_rawdata_filetype(os.path.basename(f))
+            for f in file_paths.split(";")
+        ]  # filter filenames not fasta/fastq
+        if False in is_valid_filetype:
+            return
+        md5s = d.get("fastq_md5") or d.get("submitted_md5")
+        raw_data_file_path, file_, md5_ = self._get_raw_filenames(
+            d.get("fastq_ftp"),
+            md5s,
+            d.get("run_accession"),
+            is_submitted_file,
+        )
+        return self._new_entry(d, raw_data_file_path, file_, md5_)
+
+    def _map_portal_records_columnar(self, records):
+        data, non_empty = self._portal_columns(
+            records, ["fastq_ftp", "fastq_md5", "submitted_ftp", "submitted_md5", "run_accession"]
+        )
+        md5s = data["fastq_md5"].where(non_empty["fastq_md5"], data["submitted_md5"])
+        candidates = non_empty["fastq_ftp"] & md5s.notna() & (md5s != "")
+        raw_filenames, rawdata_basenames = self._get_raw_filenames_columnar(
+            data["fastq_ftp"][candidates],
+            md5s[candidates],
+            data["run_accession"][candidates],
+            non_empty["submitted_ftp"][candidates],
+        )
+        mapped_data = []
+        for index, d in zip(data.index, records):
+            if index not in raw_filenames:
+                mapped = self._map_portal_record(d)
+            elif not rawdata_basenames[index]:
+                mapped = None
             else:
-                is_submitted_file = bool(d.get("submitted_ftp"))
-                file_paths = d.get("fastq_ftp")  # or rundata.get('submitted_ftp')??
-                is_valid_filetype = [
-                    self._is_rawdata_filetype(os.path.basename(f))
-                    for f in file_paths.split(";")
-                ]  # filter filenames not fasta/fastq
-                if False not in is_valid_filetype:
-                    md5s = d.get("fastq_md5") or d.get("submitted_md5")
-                    raw_data_file_path, file_, md5_ = self._get_raw_filenames(
-                        d.get("fastq_ftp"),
-                        md5s,
-                        d.get("run_accession"),
-                        is_submitted_file,
-                    )
-                    mapped_data.append(
-                        {
-                            "STUDY_ID": d.get("secondary_study_accession"),
-                            "SAMPLE_ID": d.get("secondary_sample_accession"),
-                            "RUN_ID": d.get("run_accession"),
-                            "DATA_FILE_ROLE": "SUBMISSION_FILE"
-                            if is_submitted_file
-                            else "GENERATED_FILE",
-                            "DATA_FILE_PATH": raw_data_file_path,
-                            "file": file_,
-                            "MD5": md5_,
-                            "LIBRARY_STRATEGY": d.get("library_strategy"),
-                            "LIBRARY_SOURCE": d.get("library_source"),
-                            "LIBRARY_LAYOUT": d.get("library_layout"),
-                            "INSTRUMENT_MODEL": d.get("instrument_model"),
-                            "INSTRUMENT_PLATFORM": d.get("instrument_platform"),
-                        }
-                    )
+                mapped = self._new_entry(d, *raw_filenames[index])
+            if mapped:
+                mapped_data.append(mapped)
         return mapped_data
 
+    def _new_entry(self, d, raw_data_file_path, file_, md5_):
+        is_submitted_file = bool(d.get("submitted_ftp"))
+        return RunEntry(
+            study_id=d.get("secondary_study_accession"),
+            sample_id=d.get("secondary_sample_accession"),
+            run_id=d.get("run_accession"),
+            data_file_role="SUBMISSION_FILE" if is_submitted_file else "GENERATED_FILE",
+            data_file_path=tuple(raw_data_file_path),
+            file=tuple(file_),
+            md5=tuple(md5_),
+            library_strategy=d.get("library_strategy"),
+            library_source=d.get("library_source"),
+            library_layout=d.get("library_layout"),
+            instrument_model=d.get("instrument_model"),
+            instrument_platform=d.get("instrument_platform"),
+            last_updated=d.get("last_updated"),
+            file_size=self._get_file_sizes(raw_data_file_path, d.get("fastq_ftp"), d.get("fastq_bytes")),
+        )
+
     def _filter_accessions_from_args(self, run_data, run_accession_field):
         if self.runs:
-            run_data = list(
-                filter(lambda r: r[run_accession_field] in self.runs, run_data)
-            )
+            runs = set(self.runs)
+            run_data = [r for r in run_data if r[run_accession_field] in runs]
         return run_data
 
     def map_project_info_to_row(self, run):
@@ -247,6 +327,14 @@ class FetchReads(AbstractDataFetcher):
             raise NoDataError(self.NO_DATA_MSG)
         return project_list
 
+    def fetch_runs(self, runs):
+        """Fetch the runs from their projects, the fetcher can be used for several calls"""
+        self.runs = list(runs)
+        try:
+            self.fetch_projects(sorted(self._get_project_accessions_from_runs(self.runs)))
+        finally:
+            self.runs = None
+
 
 def main():
     data_fetcher = FetchReads()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class Entry:
+    """Run or assembly entry, built once from the Portal API record.
+    The fields are slots named as the lower case version of KEYS. The item access with the
+    keys of the original mapping (i.e. entry["RUN_ID"] or entry["file"]) is still supported.
+    The file paths, file names, MD5s and file sizes (None if unknown) are tuples.
+    """
+
+    __slots__ = ()
+    KEYS = ()
+    FILE_FIELDS = ("data_file_path", "file", "md5", "file_size")
+
+    def __getitem__(self, key):
+        name = key.lower()
+        if name not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, name)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key.lower() in self.__slots__
+
+    def keys(self):
+        return self.KEYS
+
+    def to_dict(self):
+        return {key: getattr(self, name) for key, name in zip(self.KEYS, self.__slots__)}
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = {}
+        for key, value in data.items():
+            name = key.lower()
+            if name in cls.FILE_FIELDS and value is not None:
+                value = tuple(value)
+            fields[name] = value
+        return cls(**fields)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class RunEntry(Entry):
+    KEYS = (
+        "STUDY_ID",
+        "SAMPLE_ID",
+        "RUN_ID",
+        "DATA_FILE_ROLE",
+        "DATA_FILE_PATH",
+        "file",
+        "MD5",
+        "LIBRARY_STRATEGY",
+        "LIBRARY_SOURCE",
+        "LIBRARY_LAYOUT",
+        "INSTRUMENT_MODEL",
+        "INSTRUMENT_PLATFORM",
+        "LAST_UPDATED",
+        "FILE_SIZE",
+    )
+    __slots__ = tuple(key.lower() for key in KEYS)
+
+    def __init__(
+        self,
+        study_id=None,
+        sample_id=None,
+        run_id=None,
+        data_file_role=None,
+        data_file_path=(),
+        file=(),
+        md5=(),
+        library_strategy=None,
+        library_source=None,
+        library_layout=None,
+        instrument_model=None,
+        instrument_platform=None,
+        last_updated=None,
+        file_size=(),
+    ):
+        self.study_id = study_id
+        self.sample_id = sample_id
+        self.run_id = run_id
+        self.data_file_role = data_file_role
+        self.data_file_path = data_file_path
+        self.file = file
+        self.md5 = md5
+        self.library_strategy = library_strategy
+        self.library_source = library_source
+        self.library_layout = library_layout
+        self.instrument_model = instrument_model
+        self.instrument_platform = instrument_platform
+        self.last_updated = last_updated
+        self.file_size = file_size
+
+    @property
+    def accession(self):
+        return self.run_id
+
+
+class AssemblyEntry(Entry):
+    KEYS = (
+        "STUDY_ID",
+        "SAMPLE_ID",
+        "ANALYSIS_ID",
+        "DATA_FILE_PATH",
+        "file",
+        "MD5",
+        "ASSEMBLY_TYPE",
+        "LAST_UPDATED",
+        "FILE_SIZE",
+    )
+    __slots__ = tuple(key.lower() for key in KEYS)
+
+    def __init__(
+        self,
+        study_id=None,
+        sample_id=None,
+        analysis_id=None,
+        data_file_path=(),
+        file=(),
+        md5=(),
+        assembly_type=None,
+        last_updated=None,
+        file_size=(),
+    ):
+        self.study_id = study_id
+        self.sample_id = sample_id
+        self.analysis_id = analysis_id
+        self.data_file_path = data_file_path
+        self.file = file
+        self.md5 = md5
+        self.assembly_type = assembly_type
+        self.last_updated = last_updated
+        self.file_size = file_size
+
+    @property
+    def accession(self):
+        return self.analysis_id
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fetch daemon: runs the fetch jobs submitted over HTTP, on localhost or on a UNIX socket.
+
+The jobs are queued per client and taken round robin across the clients by the worker threads.
+Each worker keeps its fetchers, with their connections open, for the next jobs with the same options.
+
+API, JSON bodies:
+- POST /jobs {"type": "reads" | "assemblies", "dir": ..., "projects": [...], "runs": [...] | "assemblies": [...],
+  "options": {command line options by their argparse names}, "config": {config values}, "client": ...}
+  returns the job, 202
+- GET /jobs[?client=...] returns the jobs
+- GET /jobs/<id> returns the job: id, client, type, state (queued, running, done, failed), error, timestamps
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fetchtool import __version__
+from fetchtool.fetch_assemblies import FetchAssemblies
+from fetchtool.fetch_reads import FetchReads
+
+DEFAULT_PORT = 8765
+
+# job type: (fetcher class, accessions field, fetch method of the accessions)
+JOB_TYPES = {
+    "reads": (FetchReads, "runs", "fetch_runs"),
+    "assemblies": (FetchAssemblies, "assemblies", "fetch_assemblies"),
+}
+# the options set from the job fields
+JOB_FIELDS = {"dir", "projects", "project_list", "runs", "run_list", "assemblies", "assembly_list"}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    def __init__(self, client, job_type, directory, projects, accessions, options, config):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.type = job_type
+        self.dir = directory
+        self.projects = projects
+        self.accessions = accessions
+        self.options = options
+        self.config = config
+        self.state = QUEUED
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @classmethod
+    def from_request(cls, request, default_client):
+        """Validate a job request, raises ValueError"""
+        if not isinstance(request, dict):
+            raise ValueError("The job must be a JSON object")
+        job_type = request.get("type", "reads")
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type {job_type}, expected one of {', '.join(JOB_TYPES)}")
+        fetcher_class, accessions_field, _ = JOB_TYPES[job_type]
+        directory = request.get("dir")
+        if not isinstance(directory, str) or not directory:
+            raise ValueError("dir is required")
+        projects = request.get("projects") or []
+        accessions = request.get(accessions_field) or []
+        for name, values in [("projects", projects), (accessions_field, accessions)]:
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"{name} must be a list of accessions")
+        invalid_projects = [p for p in projects if not fetcher_class.is_study_accession(p)]
+        if invalid_projects:
+            raise ValueError("Invalid study accessions: " + ", ".join(invalid_projects))
+        if not projects and not accessions:
+            raise ValueError(f"No projects or {accessions_field} given")
+        options = request.get("options") or {}
+        config = request.get("config") or {}
+        if not isinstance(options, dict) or not isinstance(config, dict):
+            raise ValueError("options and config must be JSON objects")
+        known_options = set(vars(fetcher_class._build_parser().parse_args([]))) - JOB_FIELDS
+        unknown_options = set(options) - known_options
+        if unknown_options:
+            raise ValueError("Unknown options: " + ", ".join(sorted(unknown_options)))
+        client = request.get("client") or default_client
+        return cls(str(client), job_type, os.path.abspath(directory), projects, accessions, options, config)
+
+    def fetcher_key(self):
+        """The jobs with the same key can use the same fetcher"""
+        return self.type, self.dir, json.dumps(self.options, sort_keys=True), json.dumps(self.config, sort_keys=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "client": self.client,
+            "type": self.type,
+            "dir": self.dir,
+            "projects": self.projects,
+            JOB_TYPES[self.type][1]: self.accessions,
+            "state": self.state,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class FairQueue:
+    """Items queued per client, taken round robin across the clients"""
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, client, item):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The queue is closed")
+            self._queues.setdefault(client, deque()).append(item)
+            self._condition.notify()
+
+    def get(self):
+        """The next item, waits for one, None once the queue is closed"""
+        with self._condition:
+            while not self._queues and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+            client, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            if queue:
+                # the client goes after the other clients waiting
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            return item
+
+    def close(self):
+        """Wake up the workers, the items still queued are dropped"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return sum(map(len, self._queues.values()))
+
+
+class FetchService:
+    """Runs the jobs on worker threads, each worker keeps up to max_fetchers fetchers open"""
+
+    def __init__(self, workers=2, max_fetchers=8, max_finished_jobs=1000):
+        self.workers = workers
+        self.max_fetchers = max_fetchers
+        self.max_finished_jobs = max_finished_jobs
+        self.queue = FairQueue()
+        self._jobs = {}
+        self._finished_jobs = deque()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"fetch-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        """Stop the workers once their running jobs are done"""
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, request, default_client="default"):
+        job = Job.from_request(request, default_client)
+        with self._lock:
+            self._jobs[job.id] = job
+        self.queue.put(job.client, job)
+        logging.info(f"Job {job.id} queued for {job.client}")
+        return job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, client=None):
+        with self._lock:
+            return [j for j in self._jobs.values() if client is None or j.client == client]
+
+    def _work(self):
+        fetchers = OrderedDict()
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+                self._run(job, fetchers)
+        finally:
+            for fetcher in fetchers.values():
+                fetcher.close()
+
+    def _get_fetcher(self, job, fetchers):
+        key = job.fetcher_key()
+        if key in fetchers:
+            fetchers.move_to_end(key)
+        else:
+            if len(fetchers) >= self.max_fetchers:
+                fetchers.popitem(last=False)[1].close()
+            fetcher_class = JOB_TYPES[job.type][0]
+            fetchers[key] = fetcher_class.from_options(config=job.config, dir=job.dir, **job.options)
+        return fetchers[key]
+
+    def _run(self, job, fetchers):
+        job.state = RUNNING
+        job.started = time.time()
+        logging.info(f"Job {job.id} started")
+        try:
+            fetcher = self._get_fetcher(job, fetchers)
+            if job.projects:
+                fetcher.fetch_projects(job.projects)
+            if job.accessions:
+                getattr(fetcher, JOB_TYPES[job.type][2])(job.accessions)
+            job.state = DONE
+        except (Exception, SystemExit) as e:
+            logging.exception(f"Job {job.id} failed")
+            job.error = str(e) or type(e).__name__
+            job.state = FAILED
+        job.finished = time.time()
+        logging.info(f"Job {job.id} {job.state} in {job.finished - job.started:.1f} s")
+        with self._lock:
+            self._finished_jobs.append(job.id)
+            while len(self._finished_jobs) > self.max_finished_jobs:
+                self._jobs.pop(self._finished_jobs.popleft(), None)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "fetch-tool/" + __version__
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            client = parse_qs(url.query).get("client", [None])[0]
+            self._send(200, [j.to_dict() for j in self.server.service.list_jobs(client)])
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.server.service.get_job(parts[1])
+            if job is None:
+                self._send(404, {"error": f"Unknown job {parts[1]}"})
+            else:
+                self._send(200, job.to_dict())
+        else:
+            self._send(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip("/") != "jobs":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "null")
+            job = self.server.service.submit(request, default_client=self.address_string())
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        self._send(202, job.to_dict())
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # the clients of a UNIX socket have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        # the jobs write where they're told, only the user can submit them
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def create_server(service, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    """The HTTP server of the service, on the UNIX socket if socket_path is given"""
+    if socket_path:
+        server = _UnixHTTPServer(socket_path, _RequestHandler)
+    else:
+        server = _HTTPServer((host, port), _RequestHandler)
+    server.service = service
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request_server(method, path, data=None, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    """Send a request to the daemon, returns the HTTP status and the JSON response"""
+    if socket_path:
+        connection = _UnixHTTPConnection(socket_path)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        body = None if data is None else json.dumps(data)
+        connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or "null")
+    finally:
+        connection.close()
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="fetch-tool")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_address_arguments(subparser):
+        subparser.add_argument("--host", default="127.0.0.1", help="Address of the HTTP server")
+        subparser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port of the HTTP server")
+        subparser.add_argument("--socket", help="UNIX socket of the server, instead of the HTTP port")
+
+    serve = subparsers.add_parser("serve", help="Run the fetch daemon")
+    add_address_arguments(serve)
+    serve.add_argument("--workers", type=int, default=2, help="Number of jobs run at the same time")
+    serve.add_argument("--max-fetchers", type=int, default=8, help="Number of fetchers kept open by each worker")
+    serve.add_argument("-v", "--verbose", action="count", help="Verbose log level")
+
+    submit = subparsers.add_parser("submit", help="Submit a job to the fetch daemon")
+    add_address_arguments(submit)
+    submit.add_argument("--type", choices=sorted(JOB_TYPES), default="reads", help="Fetch reads or assemblies")
+    submit.add_argument("-d", "--dir", required=True, help="Base directory for downloads")
+    submit.add_argument("-p", "--projects", nargs="+", default=[], help="Study accessions")
+    submit.add_argument("-ru", "--runs", nargs="+", default=[], help="Run accessions")
+    submit.add_argument("-as", "--assemblies", nargs="+", default=[], help="Assembly accessions")
+    submit.add_argument("--options", type=json.loads, default={}, help="Fetcher options as a JSON object, e.g. '{\"private\": true}'")
+    submit.add_argument("--client", help="Client name, used to share the workers fairly")
+    submit.add_argument("--wait", action="store_true", help="Wait for the job to finish, exit with 1 if it failed")
+
+    status = subparsers.add_parser("status", help="Show the jobs of the fetch daemon")
+    add_address_arguments(status)
+    status.add_argument("job_id", nargs="?", help="Job id, all the jobs if not given")
+    return parser.parse_args(argv)
+
+
+def _address(args):
+    return {"host": args.host, "port": args.port, "socket_path": args.socket}
+
+
+def serve(args):
+    FetchReads.set_logging(args.verbose)
+    service = FetchService(workers=args.workers, max_fetchers=args.max_fetchers)
+    server = create_server(service, args.host, args.port, args.socket)
+    service.start()
+    # stop as on Ctrl-C, the socket is removed and the running jobs finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.warning(f"Serving on {args.socket or f'http://{args.host}:{server.server_address[1]}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.warning(f"Stopping, {len(service.queue)} queued jobs dropped, waiting for the running jobs")
+        server.server_close()
+        service.shutdown()
+
+
+def submit(args):
+    accessions_field = JOB_TYPES[args.type][1]
+    job = {
+        "type": args.type,
+        "dir": args.dir,
+        "projects": args.projects,
+        accessions_field: getattr(args, accessions_field),
+        "options": args.options,
+        "client": args.client,
+    }
+    status, job = request_server("POST", "/jobs", job, **_address(args))
+    if status != 202:
+        sys.exit(f"Job rejected: {job['error']}")
+    print(job["id"])
+    while args.wait and job["state"] in (QUEUED, RUNNING):
+        time.sleep(1)
+        status, job = request_server("GET", f"/jobs/{job['id']}", **_address(args))
+    if args.wait:
+        print(job["state"] + (f": {job['error']}" if job["error"] else ""))
+        if job["state"] != DONE:
+            sys.exit(1)
+
+
+def status(args):
+    status, data = request_server("GET", f"/jobs/{args.job_id}" if args.job_id else "/jobs", **_address(args))
+    print(json.dumps(data, indent=2))
+    if status != 200:
+        sys.exit(1)
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    {"serve": serve, "submit": submit, "status": status}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
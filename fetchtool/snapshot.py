@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import os
+
+SNAPSHOT_VERSION = 1
+
+
+def _open_snapshot(filename, mode, path=None):
+    """Snapshots ending with .gz are gzip compressed.
+    path: the file to open, if it's not the snapshot itself (i.e. a temporary file)
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(path or filename, mode + "t")
+    return open(path or filename, mode)
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+def write_snapshot(filename, header, projects):
+    """Write a metadata snapshot as JSON lines, a header line followed by one line per project.
+    header: dict with the fetcher details, used to validate the snapshot when it's read
+    projects: iterable of (project accession, entries) tuples
+    Returns the number of projects written.
+    """
+    count = 0
+    tmp_file = filename + ".tmp"
+    with _open_snapshot(filename, "w", path=tmp_file) as f:
+        f.write(_dumps(dict(header, version=SNAPSHOT_VERSION)))
+        for project_accession, entries in projects:
+            f.write(_dumps({"project": project_accession, "entries": entries}))
+            count += 1
+    os.replace(tmp_file, filename)
+    return count
+
+
+def read_snapshot_header(filename):
+    with _open_snapshot(filename, "r") as f:
+        header = json.loads(f.readline())
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header.get('version')} in {filename}")
+    return header
+
+
+def iter_snapshot_projects(filename):
+    """Yields the (project accession, entries) tuples of the snapshot, one project in memory at a time"""
+    with _open_snapshot(filename, "r") as f:
+        f.readline()
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                yield data["project"], data["entries"]
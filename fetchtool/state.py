@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""SQLite store of the state of a project: its entries and their files.
+
+The store is a single SQLite file in WAL mode, shared by the jobs that fetch the project.
+"""
+
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    accession TEXT PRIMARY KEY,
+    row TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    accession TEXT,
+    file_path TEXT,
+    expected_md5 TEXT,
+    verified_md5 TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    status TEXT NOT NULL DEFAULT 'expected'
+);
+CREATE INDEX IF NOT EXISTS files_accession ON files (accession);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+"""
+
+# the file is listed in the project entries, but isn't downloaded yet
+EXPECTED = "expected"
+# the file is in the raw directory, its MD5 wasn't checked
+PRESENT = "present"
+VERIFIED = "verified"
+FAILED = "failed"
+
+
+class ProjectState:
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction() as cursor:
+            # true if the store didn't exist, the caller can import the existing project files
+            self.created = not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries'").fetchone()
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    cursor.execute(statement)
+
+    def _transaction(self, write=True):
+        return _Transaction(self._connection, self._lock, write)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add_entries(self, rows, accession_field):
+        """Insert or replace the project description rows, keyed by their accession_field value"""
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO entries (accession, row) VALUES (?, ?)",
+                [(row[accession_field], json.dumps(row)) for row in rows],
+            )
+
+    def add_files(self, files):
+        """Add the expected files, a list of (name, accession, file path, expected md5) tuples.
+        The status of the files already known is kept, unless their expected MD5 changed.
+        verified_md5 is the MD5 computed for the file, when it had the recorded size and modification time.
+        """
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "INSERT INTO files (name, accession, file_path, expected_md5) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET accession = excluded.accession, file_path = excluded.file_path, "
+                "expected_md5 = excluded.expected_md5, "
+                "status = CASE WHEN files.expected_md5 IS NULL OR files.expected_md5 IS excluded.expected_md5 "
+                "THEN files.status ELSE 'expected' END",
+                files,
+            )
+
+    def add_present_files(self, files):
+        """Record the files found on disk, a list of (name, accession) tuples"""
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "INSERT INTO files (name, accession, status) VALUES (?, ?, 'present') "
+                "ON CONFLICT (name) DO UPDATE SET status = 'present' WHERE files.status = 'expected'",
+                files,
+            )
+
+    def set_file_status(self, name, status, md5=None, size=None, mtime_ns=None):
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO files (name, status, verified_md5, size, mtime_ns) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET status = excluded.status, verified_md5 = excluded.verified_md5, "
+                "size = excluded.size, mtime_ns = excluded.mtime_ns",
+                (name, status, md5, size, mtime_ns),
+            )
+
+    def get_cached_md5(self, name, size, mtime_ns):
+        """The MD5 computed for the file, if its size and modification time haven't changed since"""
+        with self._transaction(write=False) as cursor:
+            row = cursor.execute(
+                "SELECT verified_md5 FROM files WHERE name = ? AND size = ? AND mtime_ns = ?", (name, size, mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_rows(self):
+        """The project description rows"""
+        with self._transaction(write=False) as cursor:
+            return [json.loads(row) for (row,) in cursor.execute("SELECT row FROM entries ORDER BY accession")]
+
+    def get_download_rows(self):
+        """The download manifest rows of the files of the entries"""
+        with self._transaction(write=False) as cursor:
+            rows = cursor.execute("SELECT file_path, name FROM files WHERE file_path IS NOT NULL ORDER BY file_path, name")
+            return [f"{file_path}\t{name}\n" for file_path, name in rows]
+
+    def get_accessions(self, statuses=(PRESENT, VERIFIED)):
+        """The accessions with files in one of the statuses"""
+        with self._transaction(write=False) as cursor:
+            rows = cursor.execute(
+                f"SELECT DISTINCT accession FROM files WHERE accession IS NOT NULL AND status IN ({','.join('?' * len(statuses))})",
+                statuses,
+            )
+            return {accession for (accession,) in rows}
+
+    def get_status_counts(self):
+        """The number of files by status"""
+        with self._transaction(write=False) as cursor:
+            return dict(cursor.execute("SELECT status, count(*) FROM files GROUP BY status"))
+
+
+class _Transaction:
+    """Serialises the threads sharing the connection, and runs the statements in a transaction.
+    The write transactions take the database write lock when they start (BEGIN IMMEDIATE).
+    """
+
+    def __init__(self, connection, lock, write):
+        self.connection = connection
+        self.lock = lock
+        self.write = write
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE" if self.write else "BEGIN")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
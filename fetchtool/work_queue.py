@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Work queue shared by the processes of a multi-node fetch, a SQLite file on the shared filesystem.
+
+All the processes add the same items (INSERT OR IGNORE), and claim them one at a time with a lease that
+their heartbeat extends. An item whose lease expired, i.e. its worker died, is claimed again by another worker.
+SQLite locks aren't reliable on NFS: the database is in rollback journal mode, and the write transactions
+also hold a flufl.lock lock file, which is safe on NFS.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from flufl.lock import Lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, size);
+"""
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """lease: seconds before an item claimed by a worker without heartbeat is claimed again
+    max_attempts: number of claims of an item before it is failed
+    """
+
+    def __init__(self, path, lease=300, max_attempts=3, worker_id=None):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._file_lock = Lock(path + ".lock", lifetime=60, default_timeout=60 * 10)
+        self._heartbeat_stop = None
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=DELETE")
+        with self._transaction() as cursor:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    cursor.execute(statement)
+
+    def _transaction(self):
+        return _LockedTransaction(self._connection, self._lock, self._file_lock)
+
+    def close(self):
+        self.stop_heartbeat()
+        with self._lock:
+            self._connection.close()
+
+    def add_items(self, items):
+        """Add the (key, data, size) items, the items already in the queue are kept as they are"""
+        with self._transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO items (key, data, size) VALUES (?, ?, ?)",
+                [(key, json.dumps(data), size or 0) for key, data, size in items],
+            )
+
+    def claim(self):
+        """Claim the largest pending item, or an item whose lease expired.
+        Returns the (key, data) item, None if there are no items to claim.
+        """
+        now = time.time()
+        with self._transaction() as cursor:
+            # the items reclaimed too many times are failed, their download probably kills the worker
+            cursor.execute(
+                "UPDATE items SET state = 'failed', owner = NULL WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = cursor.execute(
+                "SELECT key, data FROM items WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY size DESC, key LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE key = ?",
+                (self.worker_id, now + self.lease, row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def complete(self, key, success=True):
+        """Mark a claimed item as done, or put it back in the queue if it failed and can be attempted again"""
+        with self._transaction() as cursor:
+            if success:
+                state = DONE
+            else:
+                (attempts,) = cursor.execute("SELECT attempts FROM items WHERE key = ?", (key,)).fetchone()
+                state = PENDING if attempts < self.max_attempts else FAILED
+            cursor.execute("UPDATE items SET state = ?, owner = NULL, lease_expires = NULL WHERE key = ? AND owner = ?", (state, key, self.worker_id))
+
+    def heartbeat(self):
+        """Extend the leases of the items claimed by the worker"""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE items SET lease_expires = ? WHERE state = 'leased' AND owner = ?", (time.time() + self.lease, self.worker_id)
+            )
+
+    def start_heartbeat(self):
+        """Extend the leases from a background thread, 3 times per lease"""
+        if self._heartbeat_stop is not None:
+            return
+        self._heartbeat_stop = threading.Event()
+        thread = threading.Thread(target=self._heartbeat_loop, args=(self._heartbeat_stop,), name="work-queue-heartbeat", daemon=True)
+        thread.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat_stop is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat_stop = None
+
+    def _heartbeat_loop(self, stop):
+        while not stop.wait(self.lease / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.warning(f"Work queue heartbeat failed: {e}")
+
+    def get_state_counts(self):
+        """The number of items by state"""
+        with self._lock:
+            return dict(self._connection.execute("SELECT state, count(*) FROM items GROUP BY state"))
+
+
+class _LockedTransaction:
+    """Write transaction holding the thread lock, the lock file and the database write lock"""
+
+    def __init__(self, connection, lock, file_lock):
+        self.connection = connection
+        self.lock = lock
+        self.file_lock = file_lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.file_lock.lock()
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+            except BaseException:
+                self.file_lock.unlock()
+                raise
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            try:
+                self.file_lock.unlock()
+            finally:
+                self.lock.release()
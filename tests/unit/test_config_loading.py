@@ -28,6 +28,10 @@ class TestConfigLoading:
             "ena_api_username": "",
             "ena_api_password": "",
             "url_max_attempts": 5,
+            "portal_page_size": 10000,
+            "portal_page_workers": 4,
+            "bulk_query_size": 50,
+            "columnar_mapping_threshold": 0,
             "fire_endpoint": "https://hl.fire.sdo.ebi.ac.uk",
             "fire_ena_bucket": "era-public",
             "fire_access_key_id": "",
@@ -40,6 +44,10 @@ class TestConfigLoading:
             "ena_api_username": "ENA_FAKE",
             "ena_api_password": "FAKE",
             "url_max_attempts": 10,
+            "portal_page_size": 10000,
+            "portal_page_workers": 4,
+            "bulk_query_size": 50,
+            "columnar_mapping_threshold": 0,
             "fire_endpoint": "fake_endpoint",
             "fire_ena_bucket": "fake_bucket",
             "fire_access_key_id": "",
@@ -52,6 +60,10 @@ class TestConfigLoading:
             "ena_api_username": "",
             "ena_api_password": "",
             "url_max_attempts": 8,
+            "portal_page_size": 10000,
+            "portal_page_workers": 4,
+            "bulk_query_size": 50,
+            "columnar_mapping_threshold": 0,
             "fire_endpoint": "fake_endpoint",
             "fire_ena_bucket": "fake_bucket",
             "fire_access_key_id": "",
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from fetchtool import fetch_assemblies, fetch_reads
+from fetchtool.desc_file import file_version
+
+
+def run_row(run_id, library_layout="PAIRED", **kwargs):
+    row = {
+        "study_id": "ERP110686",
+        "sample_id": "ERS2702568",
+        "run_id": run_id,
+        "library_layout": library_layout,
+        "file": [run_id + "_1.fastq.gz", run_id + "_2.fastq.gz"],
+        "file_path": ["ftp.sra.ebi.ac.uk/vol1/" + run_id + "_1.fastq.gz", "ftp.sra.ebi.ac.uk/vol1/" + run_id + "_2.fastq.gz"],
+        "library_strategy": "WGS",
+        "library_source": "METAGENOMIC",
+        "instrument_model": "Illumina HiSeq 2500",
+        "instrument_platform": "ILLUMINA",
+    }
+    row.update(kwargs)
+    return row
+
+
+def assembly_row(analysis_id):
+    return {
+        "study_id": "ERP123564",
+        "sample_id": "ERS4588205",
+        "analysis_id": analysis_id,
+        "file": [analysis_id + ".fasta.gz"],
+        "file_path": ["ftp.sra.ebi.ac.uk/vol1/" + analysis_id + ".fasta.gz"],
+        "scientific_name": "n/a",
+        "md5": ("e0e3c99075ae482083b3e8ca35e401e2",),
+    }
+
+
+RUN_UPDATES = [
+    [run_row("ERR3"), run_row("ERR1")],
+    [run_row("ERR2", instrument_model=None), run_row("ERR1", library_layout="SINGLE")],
+    [run_row("ERR0", library_strategy="NA"), run_row("ERR4", library_source=""), run_row("ERR4", sample_id="ERS1")],
+    [run_row("ERR2", instrument_platform="with\ttab"), run_row("ERR5", instrument_model='say "hi"')],
+]
+
+ASSEMBLY_UPDATES = [
+    [assembly_row("ERZ2"), assembly_row("ERZ1")],
+    [assembly_row("ERZ3"), assembly_row("ERZ1"), assembly_row("ERZ0")],
+]
+
+
+def write_updates(fetch, project_accession, updates):
+    os.makedirs(fetch.get_project_workdir(project_accession), exist_ok=True)
+    contents = []
+    for rows in updates:
+        fetch.write_project_description_file(project_accession, rows)
+        with open(fetch.get_project_filepath(project_accession), "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def rewrite_updates(fetch, project_accession, updates):
+    os.makedirs(fetch.get_project_workdir(project_accession), exist_ok=True)
+    contents = []
+    for rows in updates:
+        fetch._rewrite_project_description_file(project_accession, list(map(fetch.clean_data_row, rows)))
+        with open(fetch.get_project_filepath(project_accession), "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+class TestDescriptionFile:
+    @pytest.mark.parametrize(
+        "fetcher, project_accession, updates",
+        [
+            (fetch_reads.FetchReads, "ERP110686", RUN_UPDATES),
+            (fetch_assemblies.FetchAssemblies, "ERP123564", ASSEMBLY_UPDATES),
+        ],
+    )
+    def test_merge_should_match_pandas_rewrite(self, tmpdir, fetcher, project_accession, updates):
+        fetch = fetcher(argv=["-p", project_accession, "-d", str(tmpdir.join("merged"))])
+        merged = write_updates(fetch, project_accession, updates)
+        rewritten_fetch = fetcher(argv=["-p", project_accession, "-d", str(tmpdir.join("rewritten"))])
+        rewritten = rewrite_updates(rewritten_fetch, project_accession, updates)
+        assert merged == rewritten
+        assert not [f for f in os.listdir(fetch.get_project_workdir(project_accession)) if f.endswith(".tmp")]
+
+    @pytest.mark.parametrize(
+        "existing",
+        [
+            # unsorted
+            "study_id\tsample_id\trun_id\nERP110686\tERS1\tERR9\nERP110686\tERS1\tERR1\n",
+            # duplicated runs, missing values, empty lines
+            "study_id\trun_id\tlibrary_layout\n\nERP110686\tERR1\tNA\nERP110686\tERR1\tnull\n\n",
+            # empty file
+            "",
+        ],
+    )
+    def test_unmergeable_file_should_be_rewritten(self, tmpdir, existing):
+        contents = []
+        for directory in ["merged", "rewritten"]:
+            fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir.join(directory))])
+            os.makedirs(fetch.get_project_workdir("ERP110686"))
+            with open(fetch.get_project_filepath("ERP110686"), "w") as f:
+                f.write(existing)
+            update = [run_row("ERR5"), run_row("ERR1")]
+            contents += (write_updates if directory == "merged" else rewrite_updates)(fetch, "ERP110686", [update])
+        assert contents[0] == contents[1]
+
+    def test_merge_should_not_rename_a_file_changed_by_another_process(self, tmpdir):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        write_updates(fetch, "ERP110686", [[run_row("ERR1")]])
+        # the file changes between the merge and the lock of the first attempt
+        versions = iter([("before",), ("after",)])
+        with patch("fetchtool.abstract_fetch.file_version", side_effect=lambda path: next(versions, None) or file_version(path)) as mock:
+            fetch.write_project_description_file("ERP110686", [run_row("ERR2")])
+        assert mock.call_count == 4
+        with open(fetch.get_project_filepath("ERP110686")) as f:
+            assert [line.split("\t")[2] for line in f] == ["run_id", "ERR1", "ERR2"]
+        assert not [f for f in os.listdir(fetch.get_project_workdir("ERP110686")) if f.endswith(".tmp")]
+
+    def test_fix_desc_file_should_only_add_downloaded_or_existing_runs(self, tmpdir):
+        contents = []
+        for directory in ["merged", "rewritten"]:
+            argv = ["-p", "ERP110686", "-d", str(tmpdir.join(directory))]
+            write_updates(fetch_reads.FetchReads(argv=argv), "ERP110686", [[run_row("ERR1")]])
+            fetch = fetch_reads.FetchReads(argv=argv + ["--fix-desc-file"])
+            os.makedirs(fetch.get_project_rawdir("ERP110686"))
+            open(os.path.join(fetch.get_project_rawdir("ERP110686"), "ERR3_1.fastq.gz"), "w").close()
+            update = [run_row("ERR1", library_layout="SINGLE"), run_row("ERR2"), run_row("ERR3")]
+            contents += (write_updates if directory == "merged" else rewrite_updates)(fetch, "ERP110686", [update])
+        assert contents[0] == contents[1]
+        assert [line.split("\t")[2:5] for line in contents[0].decode().splitlines()[1:]] == [
+            ["ERR1", "n/a", "SINGLE"],
+            ["ERR3", "n/a", "PAIRED"],
+        ]
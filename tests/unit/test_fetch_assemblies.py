@@ -46,8 +46,17 @@ class TestFetchAssemblies:
             "assembly_list",
             "assembly_type",
             "fix_desc_file",
+            "state_db",
+            "shard",
+            "shard_by",
+            "work_queue",
             "ignore_errors",
             "ebi",
+            "bulk",
+            "incremental",
+            "reconcile",
+            "export_snapshot",
+            "from_snapshot",
         }
         assert set(vars(args)) == accepted_args
 
@@ -237,6 +246,38 @@ class TestFetchAssemblies:
             txt_data = t.readlines()
             assert len(txt_data) == 2
 
+    def test_multiple_assembly_types_should_be_queried_together(self, tmpdir):
+        fetch = fetch_assemblies.FetchAssemblies(
+            argv=["-p", "ERP123564", "-d", str(tmpdir), "--assembly-type", "primary metagenome", "metatranscriptome"]
+        )
+        assert fetch.assembly_types == ["metatranscriptome", "primary metagenome"]
+        records = self.mock_get_assembly_metadata(None)
+        records[3]["assembly_type"] = "metatranscriptome"
+        with patch.object(fetch, "_retrieve_ena_url", return_value=records) as mock:
+            assemblies = fetch._retrieve_project_info_from_api("ERP123564")
+        url = mock.call_args_list[0][0][0]
+        assert "%28assembly_type=%22metatranscriptome%22%20OR%20assembly_type=%22primary metagenome%22%29" in url
+        assert [a["ASSEMBLY_TYPE"] for a in assemblies] == ["metatranscriptome"]
+
+    def test_all_assembly_types(self, tmpdir):
+        fetch = fetch_assemblies.FetchAssemblies(argv=["-p", "ERP123564", "-d", str(tmpdir), "--assembly-type", "all"])
+        assert fetch.assembly_types == fetch_assemblies.FetchAssemblies.ASSEMBLY_TYPES
+
+    def test_columnar_mapping_should_match_the_record_mapping(self, tmpdir):
+        records = self.mock_get_assembly_metadata(None)
+        secondary_files = dict(
+            records[3],
+            analysis_accession="ERZ1505407",
+            generated_ftp="ftp.sra.ebi.ac.uk/vol1/ERZ1505407.md5;ftp.sra.ebi.ac.uk/vol1/contig_2.fa.gz",
+            generated_md5="e0e3c99075ae482083b3e8ca35e401e2;e0e3c99075ae482083b3e8ca35e401e3",
+        )
+        binned = dict(records[3], analysis_accession="ERZ1505408", assembly_type="binned metagenome")
+        records += [secondary_files, binned]
+        fetch = fetch_assemblies.FetchAssemblies(argv=["-p", "ERP123564", "-d", str(tmpdir)])
+        expected = [m for m in map(fetch._map_portal_record, records) if m]
+        assert [a["ANALYSIS_ID"] for a in expected] == ["ERZ1505406", "ERZ1505407"]
+        assert fetch._map_portal_records_columnar(records) == expected
+
     @patch.object(fetch_assemblies.FetchAssemblies, "fetch")
     def test_main_should_call_fetch(self, mock):
         test_args = ["scriptname", "-p", "ERP123564"]
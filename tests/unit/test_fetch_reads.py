@@ -22,6 +22,7 @@ from unittest.mock import patch
 import pytest
 
 from fetchtool import fetch_reads
+from fetchtool.abstract_fetch import AbstractDataFetcher
 
 FIXTURES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "fixtures"))
 
@@ -44,8 +45,17 @@ class TestFetchReads:
             "runs",
             "run_list",
             "fix_desc_file",
+            "state_db",
+            "shard",
+            "shard_by",
+            "work_queue",
             "ignore_errors",
             "ebi",
+            "bulk",
+            "incremental",
+            "reconcile",
+            "export_snapshot",
+            "from_snapshot",
         }
         assert set(vars(args)) == accepted_args
 
@@ -229,6 +239,204 @@ class TestFetchReads:
             txt_data = t.readlines()
             assert len(txt_data) == 2
 
+    def test_retrieve_project_should_map_all_pages(self, tmpdir):
+        records = self.mock_get_run_metadata(None) * 3
+        requested_offsets = []
+
+        def mock_get_page(url, raise_on_204=True):
+            offset = int(url.split("offset=")[-1])
+            requested_offsets.append(offset)
+            return records[offset : offset + 2] or None
+
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        fetch.config["portal_page_size"] = 2
+        with patch.object(fetch, "_retrieve_ena_url", side_effect=mock_get_page):
+            runs = fetch._retrieve_project_info_from_api("ERP110686")
+        assert [r["RUN_ID"] for r in runs] == ["ERR2777790"] * 3
+        assert {0, 2, 4, 6, 8} <= set(requested_offsets)
+
+    def test_retrieve_project_should_not_paginate_if_disabled(self, tmpdir):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        fetch.config["portal_page_size"] = 0
+        with patch.object(fetch, "_retrieve_ena_url", return_value=self.mock_get_run_metadata(None)) as mock:
+            runs = fetch._retrieve_project_info_from_api("ERP110686")
+        assert len(runs) == 1
+        assert "offset=" not in mock.call_args[0][0]
+
+    def test_fetch_bulk_should_split_entries_per_project(self, tmpdir):
+        records = self.mock_get_run_metadata(None)
+        other_project_run = dict(records[2], secondary_study_accession="ERP110687", run_accession="ERR2777791")
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "ERP110687", "ERP110688", "--bulk", "-d", str(tmpdir)])
+        fetch.config["portal_page_size"] = 0
+        with patch.object(fetch, "_retrieve_ena_url", return_value=records + [other_project_run]) as mock_url, patch.object(
+            fetch, "retrieve_project", return_value=None
+        ) as mock_retrieve_project, patch.object(fetch, "fetch_project") as mock_fetch_project:
+            fetch.fetch()
+        assert mock_url.call_count == 1
+        assert "secondary_study_accession=%22ERP110688%22" in mock_url.call_args[0][0]
+        calls = {c[0][0]: c[0][1] for c in mock_fetch_project.call_args_list}
+        assert [r["RUN_ID"] for r in calls["ERP110686"]] == ["ERR2777790"]
+        assert [r["RUN_ID"] for r in calls["ERP110687"]] == ["ERR2777791"]
+        # not in the bulk results, the project goes through the per project query
+        mock_retrieve_project.assert_called_once_with("ERP110688")
+        assert calls["ERP110688"] == []
+
+    def test_fetch_project_should_write_sync_mark(self, tmpdir):
+        records = self.mock_get_run_metadata(None)
+        records[2]["last_updated"] = "2023-05-04"
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        with patch.object(fetch, "_retrieve_ena_url", return_value=records), patch.object(fetch, "download_raw_file", return_value=True):
+            fetch.fetch_project("ERP110686")
+        assert fetch.get_project_sync_mark("ERP110686") == "2023-05-04"
+
+    def test_incremental_should_query_updated_entries_only(self, tmpdir):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--incremental"])
+        with patch.object(fetch, "get_project_sync_mark", return_value="2023-05-04"), patch.object(
+            fetch, "_retrieve_ena_url", return_value=None
+        ) as mock:
+            runs = fetch._retrieve_project_info_from_api("ERP110686")
+        assert runs == []
+        assert "last_updated%3E%3D2023-05-04" in mock.call_args_list[0][0][0]
+        assert mock.call_args_list[0][1] == {"raise_on_204": False}
+
+    def test_reconcile_should_skip_existing_files(self, tmpdir):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--reconcile"])
+        dest = tmpdir / "ERR2777790_1.fastq.gz"
+        Path(str(dest)).touch()
+        with patch.object(fetch, "_is_file_valid") as mock:
+            assert fetch.download_raw_file("ftp.sra.ebi.ac.uk/vol1/ERR2777790_1.fastq.gz", str(dest), ["md5"])
+        assert not mock.called
+
+    def test_download_file_should_be_appended_and_compacted(self, tmpdir):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        os.makedirs(fetch.get_project_workdir("ERP110686"))
+        download_file = fetch.get_project_download_file("ERP110686")
+        fetch.write_project_download_file("ERP110686", [{"file_path": ["b/ERR2", "a/ERR1"], "file": ["ERR2", "ERR1"]}])
+        fetch.write_project_download_file("ERP110686", [{"file_path": ["a/ERR1"], "file": ["ERR1"]}])
+        with open(download_file) as f:
+            assert f.readlines() == ["b/ERR2\tERR2\n", "a/ERR1\tERR1\n", "a/ERR1\tERR1\n"]
+        assert fetch.read_download_data("ERP110686") == ["a/ERR1\tERR1\n", "b/ERR2\tERR2\n"]
+
+        # the manifest is compacted while the next rows are written to the old file
+        write = os.write
+
+        def compact_and_write(fd, data):
+            if not compacted:
+                compacted.append(fetch.compact_project_download_file("ERP110686"))
+            return write(fd, data)
+
+        compacted = []
+        with patch("os.write", side_effect=compact_and_write):
+            fetch.write_project_download_file("ERP110686", [{"file_path": ["c/ERR3"], "file": ["ERR3"]}])
+        assert compacted == [True]
+        with open(download_file) as f:
+            assert f.readlines() == ["a/ERR1\tERR1\n", "b/ERR2\tERR2\n", "c/ERR3\tERR3\n"]
+
+    def test_columnar_mapping_should_match_the_record_mapping(self, tmpdir):
+        records = self.mock_get_run_metadata(None)
+        generated = dict(records[2], run_accession="ERR2777791", submitted_ftp="", submitted_md5="")
+        single_submitted = dict(
+            records[2],
+            run_accession="ERR2777792",
+            fastq_ftp="ftp.sra.ebi.ac.uk/vol1/fastq/ERR277/ERR2777792/reads.fastq.gz",
+            fastq_md5="",
+            submitted_md5="39f9956b66880e386d741eea2a0e54c2",
+        )
+        fasta_submitted = dict(
+            records[2], run_accession="ERR2777793", fastq_ftp="a/ERR2777793_1.FNA.gz;a/ERR2777793_2.fna.gz"
+        )
+        missing_md5 = dict(generated, run_accession="ERR2777794", fastq_md5="39f9956b66880e386d741eea2a0e54c1")
+        records += [generated, single_submitted, fasta_submitted, missing_md5]
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir)])
+        expected = [m for m in map(fetch._map_portal_record, records) if m]
+        assert len(expected) == 4
+        assert fetch._map_portal_records_columnar(records) == expected
+        fetch.config["columnar_mapping_threshold"] = 1
+        assert fetch._map_portal_pages([records]) == (len(records), expected)
+
+    @pytest.mark.parametrize("shard_by", ["run", "file", "size"])
+    def test_shards_should_split_the_files(self, tmpdir, shard_by):
+        records = []
+        for i in range(40):
+            paths = [f"ftp.sra.ebi.ac.uk/vol1/ERR{i}/ERR{i}_1.fastq.gz", f"ftp.sra.ebi.ac.uk/vol1/ERR{i}/ERR{i}_2.fastq.gz"]
+            records.append(
+                dict(
+                    self.mock_get_run_metadata(None)[2],
+                    run_accession=f"ERR{i}",
+                    fastq_ftp=";".join(paths),
+                    fastq_bytes=f"{i * 1000};{i * 1000}",
+                )
+            )
+        shards = []
+        for index in range(1, 4):
+            fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--shard", f"{index}/3", "--shard-by", shard_by])
+            entries = fetch._map_portal_records_columnar(records)
+            shards.append([(e["RUN_ID"], f, size) for e in fetch.shard_entries(entries) for f, size in zip(e["file"], e["FILE_SIZE"])])
+        files = [f for shard in shards for f in shard]
+        assert sorted(files) == sorted((e["RUN_ID"], f, size) for e in entries for f, size in zip(e["file"], e["FILE_SIZE"]))
+        assert all(shards)
+        if shard_by == "size":
+            loads = [sum(size for _, _, size in shard) for shard in shards]
+            assert max(loads) - min(loads) <= 2 * 39 * 1000
+
+    def test_shards_should_write_the_same_project_files(self, tmpdir):
+        records = [dict(self.mock_get_run_metadata(None)[2], run_accession=f"ERR{i}", last_updated="2023-05-04") for i in range(10)]
+        contents = []
+        for directory, shards in [("all", [[]]), ("shards", [["--shard", "1/2"], ["--shard", "2/2"]])]:
+            downloaded = []
+            for shard in shards:
+                fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir.join(directory))] + shard)
+                entries = fetch._map_portal_records_columnar(records)
+                with patch.object(fetch, "download_raw_file", side_effect=lambda url, dest, md5s: downloaded.append(url)):
+                    fetch.fetch_project("ERP110686", entries)
+                assert (fetch.get_project_sync_mark("ERP110686") is None) == bool(shard)
+            with open(fetch.get_project_filepath("ERP110686")) as f:
+                contents.append((sorted(downloaded), f.read(), fetch.read_download_data("ERP110686")))
+        assert contents[0] == contents[1]
+
+    def test_shard_should_be_valid(self):
+        for shard in ["0/3", "4/3", "1"]:
+            with pytest.raises(SystemExit):
+                fetch_reads.FetchReads(argv=["-p", "ERP110686", "--shard", shard])
+
+    def test_from_options_should_not_parse_argv(self, tmpdir):
+        with patch.object(sys, "argv", ["scriptname", "--unknown"]), patch("logging.basicConfig") as mock:
+            fetch = fetch_reads.FetchReads.from_options(dir=str(tmpdir), config={"url_max_attempts": 1})
+        assert not mock.called
+        assert fetch.args.dir == str(tmpdir) and fetch.args.projects is None
+        assert fetch.config["url_max_attempts"] == 1
+        with pytest.raises(ValueError):
+            fetch_reads.FetchReads.from_options(dir=str(tmpdir), project="ERP110686")
+
+    def test_fetcher_should_be_reused_across_calls(self, tmpdir):
+        records = self.mock_get_run_metadata(None)
+        with fetch_reads.FetchReads.from_options(dir=str(tmpdir)) as fetch:
+            fetch.config["portal_page_size"] = 0
+            with patch.object(fetch, "_retrieve_ena_url", return_value=records), patch.object(
+                fetch, "_get_project_accessions_from_runs", return_value={"ERP110686"}
+            ), patch.object(fetch, "fetch_project") as mock:
+                fetch.fetch_projects(["ERP110686"])
+                fetch.fetch_runs(["ERR2777790"])
+                with pytest.raises(ValueError):
+                    fetch.fetch_projects(["ERR2777790"])
+            assert [c[0][0] for c in mock.call_args_list] == ["ERP110686", "ERP110686"]
+            assert fetch.runs is None
+            session = fetch._get_http_session()
+            assert fetch._get_http_session() is session
+        assert fetch._http_session is None
+
+    def test_ftp_connection_should_be_reused(self, tmpdir):
+        fetch = fetch_reads.FetchReads.from_options(dir=str(tmpdir))
+        with patch("ftplib.FTP") as mock:
+            mock.return_value.pwd.return_value = "/"
+            for url in ["ftp.sra.ebi.ac.uk/vol1/ERR1.fastq.gz", "ftp.sra.ebi.ac.uk/vol1/ERR2.fastq.gz"]:
+                # FetchReads.download_lftp is replaced by other tests
+                assert AbstractDataFetcher.download_lftp(fetch, str(tmpdir / os.path.basename(url)), url)
+        assert mock.call_count == 1
+        assert mock.return_value.login.call_count == 1
+        fetch.close()
+        assert mock.return_value.close.called
+
     @patch.object(fetch_reads.FetchReads, "fetch")
     def test_main_should_call_fetch(self, mock):
         test_args = ["scriptname", "-p", "ERP110686"]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+
+import pytest
+
+from fetchtool import __version__
+
+# only imported by the code paths that use them
+HEAVY_MODULES = ["boto3", "botocore", "pandas", "numpy", "requests"]
+
+
+class TestImports:
+    @pytest.mark.parametrize("module", ["fetchtool.fetch_reads", "fetchtool.fetch_assemblies"])
+    def test_import_should_not_load_heavy_modules(self, module):
+        code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.split() == []
+
+    def test_version_should_not_load_heavy_modules(self):
+        code = (
+            "import sys\n"
+            "from fetchtool import fetch_reads\n"
+            "try:\n"
+            "    fetch_reads.FetchReads(argv=['--version'])\n"
+            "except SystemExit:\n"
+            f"    print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.split() == [__version__]
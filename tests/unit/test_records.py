@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from fetchtool.records import AssemblyEntry, RunEntry
+
+
+class TestRecords:
+    def test_entry_should_support_the_mapping_keys(self):
+        entry = RunEntry(run_id="ERR599830", file=("ERR599830_1.fastq.gz", "ERR599830_2.fastq.gz"), md5=("a", "b"))
+        assert entry["RUN_ID"] == entry["run_id"] == entry.run_id == entry.accession == "ERR599830"
+        assert entry["file"] == ("ERR599830_1.fastq.gz", "ERR599830_2.fastq.gz")
+        assert entry["MD5"] == ("a", "b")
+        assert entry.get("LAST_UPDATED") is None
+        assert entry.get("UNKNOWN", "n/a") == "n/a"
+        assert "STUDY_ID" in entry
+        with pytest.raises(KeyError):
+            entry["UNKNOWN"]
+
+    def test_entry_should_not_have_a_dict(self):
+        entry = AssemblyEntry(analysis_id="ERZ477685")
+        with pytest.raises(AttributeError):
+            entry.unknown = "value"
+
+    def test_entry_dict_round_trip(self):
+        entry = AssemblyEntry(
+            study_id="ERP104225",
+            sample_id="ERS599830",
+            analysis_id="ERZ477685",
+            data_file_path=("ftp.sra.ebi.ac.uk/vol1/sequence/ERZ477/ERZ477685/contig.fa.gz",),
+            file=("ERZ477685.fasta.gz",),
+            md5=("md51",),
+        )
+        data = entry.to_dict()
+        assert data["ANALYSIS_ID"] == "ERZ477685"
+        assert data["file"] == ("ERZ477685.fasta.gz",)
+        data["file"] = list(data["file"])
+        assert AssemblyEntry.from_dict(data) == entry
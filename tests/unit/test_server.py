@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from fetchtool import server
+from fetchtool.fetch_reads import FetchReads
+
+
+def wait_for_jobs(address, job_ids, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = [server.request_server("GET", f"/jobs/{job_id}", **address)[1] for job_id in job_ids]
+        if all(j["state"] in (server.DONE, server.FAILED) for j in jobs):
+            return jobs
+        time.sleep(0.05)
+    raise TimeoutError(job_ids)
+
+
+@pytest.fixture(params=["http", "unix"])
+def address(request, tmpdir):
+    service = server.FetchService(workers=1)
+    if request.param == "unix":
+        address = {"socket_path": str(tmpdir.join("fetch.sock"))}
+        http_server = server.create_server(service, socket_path=address["socket_path"])
+    else:
+        http_server = server.create_server(service, port=0)
+        address = {"port": http_server.server_address[1]}
+    service.start()
+    thread = threading.Thread(target=http_server.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.start()
+    yield address
+    http_server.shutdown()
+    http_server.server_close()
+    service.shutdown()
+    thread.join()
+
+
+class TestServer:
+    def test_queue_should_alternate_between_clients(self):
+        queue = server.FairQueue()
+        for client, item in [("a", 1), ("a", 2), ("a", 3), ("b", 4), ("c", 5), ("b", 6)]:
+            queue.put(client, item)
+        assert [queue.get() for _ in range(6)] == [1, 4, 5, 2, 6, 3]
+        queue.close()
+        assert queue.get() is None
+
+    def test_jobs_should_reuse_the_fetchers(self, tmpdir, address):
+        with patch.object(FetchReads, "from_options", wraps=FetchReads.from_options) as mock_from_options, patch.object(
+            FetchReads, "fetch_projects", side_effect=[None, ValueError("no data")]
+        ) as mock_fetch:
+            job_ids = []
+            for projects in [["ERP110686"], ["ERP001736"]]:
+                status, job = server.request_server("POST", "/jobs", {"dir": str(tmpdir), "projects": projects}, **address)
+                assert status == 202
+                job_ids.append(job["id"])
+            jobs = wait_for_jobs(address, job_ids)
+        assert [j["state"] for j in jobs] == [server.DONE, server.FAILED]
+        assert jobs[1]["error"] == "no data"
+        assert [c[0][0] for c in mock_fetch.call_args_list] == [["ERP110686"], ["ERP001736"]]
+        assert mock_from_options.call_count == 1
+        status, listed = server.request_server("GET", "/jobs", **address)
+        assert status == 200 and {j["id"] for j in listed} == set(job_ids)
+
+    @pytest.mark.parametrize(
+        "job",
+        [
+            {"projects": ["ERP110686"]},
+            {"dir": "out"},
+            {"dir": "out", "projects": ["ERR2777790"]},
+            {"dir": "out", "type": "other", "projects": ["ERP110686"]},
+            {"dir": "out", "projects": ["ERP110686"], "options": {"projects": ["ERP001736"]}},
+            {"dir": "out", "projects": ["ERP110686"], "options": {"unknown": True}},
+        ],
+    )
+    def test_invalid_jobs_should_be_rejected(self, address, job):
+        status, response = server.request_server("POST", "/jobs", job, **address)
+        assert status == 400
+        assert response["error"]
+        assert server.request_server("GET", "/jobs/unknown", **address)[0] == 404
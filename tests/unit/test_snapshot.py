@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from fetchtool import fetch_assemblies, fetch_reads
+from fetchtool.exceptions import ENAFetchFail
+from fetchtool.records import RunEntry
+
+ENTRIES = {
+    "ERP110686": [
+        RunEntry.from_dict(
+            {
+                "STUDY_ID": "ERP110686",
+                "SAMPLE_ID": "ERS2702568",
+                "RUN_ID": "ERR2777790",
+                "DATA_FILE_ROLE": "GENERATED_FILE",
+                "DATA_FILE_PATH": ["ftp.sra.ebi.ac.uk/vol1/fastq/ERR277/009/ERR2777790/ERR2777790_1.fastq.gz"],
+                "file": ["ERR2777790_1.fastq.gz"],
+                "MD5": ["39f9956b66880e386d741eea2a0e54c1"],
+                "LIBRARY_STRATEGY": "AMPLICON",
+                "LIBRARY_SOURCE": "METAGENOMIC",
+                "LIBRARY_LAYOUT": "SINGLE",
+                "INSTRUMENT_MODEL": "unspecified",
+                "INSTRUMENT_PLATFORM": "LS454",
+                "LAST_UPDATED": "2023-05-04",
+            }
+        )
+    ],
+    "ERP110687": [],
+}
+
+
+class TestSnapshot:
+    @pytest.mark.parametrize("snapshot_name", ["snapshot.jsonl", "snapshot.jsonl.gz"])
+    def test_export_and_replay_snapshot(self, tmpdir, snapshot_name):
+        snapshot_file = os.path.join(str(tmpdir), snapshot_name)
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "ERP110687", "-d", str(tmpdir), "--export-snapshot", snapshot_file])
+        with patch.object(fetch, "retrieve_project", side_effect=lambda p: ENTRIES[p]), patch.object(fetch, "fetch_project") as mock:
+            fetch.fetch()
+        assert not mock.called
+        assert os.listdir(str(tmpdir)) == [snapshot_name]
+
+        fetch = fetch_reads.FetchReads(argv=["-d", str(tmpdir), "--from-snapshot", snapshot_file])
+        with patch.object(fetch, "_retrieve_ena_url", side_effect=ENAFetchFail), patch.object(fetch, "fetch_project") as mock:
+            fetch.fetch()
+        assert [c[0] for c in mock.call_args_list] == list(ENTRIES.items())
+
+    def test_replay_should_only_fetch_the_requested_projects(self, tmpdir):
+        snapshot_file = os.path.join(str(tmpdir), "snapshot.jsonl")
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "ERP110687", "-d", str(tmpdir), "--export-snapshot", snapshot_file])
+        with patch.object(fetch, "retrieve_project", side_effect=lambda p: ENTRIES[p]):
+            fetch.fetch()
+
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110687", "-d", str(tmpdir), "--from-snapshot", snapshot_file])
+        with patch.object(fetch, "fetch_project") as mock:
+            fetch.fetch()
+        assert [c[0] for c in mock.call_args_list] == [("ERP110687", [])]
+
+    def test_replay_should_reject_snapshot_from_other_fetcher(self, tmpdir):
+        snapshot_file = os.path.join(str(tmpdir), "snapshot.jsonl")
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--export-snapshot", snapshot_file])
+        with patch.object(fetch, "retrieve_project", side_effect=lambda p: ENTRIES[p]):
+            fetch.fetch()
+
+        fetch = fetch_assemblies.FetchAssemblies(argv=["-d", str(tmpdir), "--from-snapshot", snapshot_file])
+        with pytest.raises(ValueError):
+            fetch.fetch()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+from unittest.mock import patch
+
+from fetchtool import abstract_fetch, fetch_reads
+from fetchtool.records import RunEntry
+
+CONTENT = b"@read\nACGT\n+\nIIII\n"
+
+
+def run_entry(run_id, md5):
+    return RunEntry(
+        study_id="ERP110686",
+        sample_id="ERS2702568",
+        run_id=run_id,
+        data_file_role="GENERATED_FILE",
+        data_file_path=(f"ftp.sra.ebi.ac.uk/vol1/fastq/{run_id}/{run_id}.fastq.gz",),
+        file=(f"{run_id}.fastq.gz",),
+        md5=(md5,),
+        library_strategy="WGS",
+        library_source="METAGENOMIC",
+        library_layout="SINGLE",
+        instrument_model="unspecified",
+        instrument_platform="ILLUMINA",
+    )
+
+
+def download(fetch, dest, url):
+    with open(dest, "wb") as f:
+        f.write(CONTENT)
+    return True
+
+
+class TestProjectState:
+    def fetch_project(self, directory, argv, entries):
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", directory] + argv)
+        with patch.object(fetch_reads.FetchReads, "download_lftp", download):
+            fetch.fetch_project("ERP110686", entries)
+        return fetch
+
+    def test_description_file_should_be_generated_from_the_state(self, tmpdir):
+        entries = [run_entry("ERR1", hashlib.md5(CONTENT).hexdigest()), run_entry("ERR2", "0" * 32)]
+        contents = []
+        for directory, argv in [("files", []), ("state", ["--state-db"])]:
+            fetch = self.fetch_project(str(tmpdir.join(directory)), argv + ["--ignore-errors"], entries[:1])
+            fetch = self.fetch_project(str(tmpdir.join(directory)), argv + ["--ignore-errors"], entries[1:])
+            with open(fetch.get_project_filepath("ERP110686")) as f:
+                contents.append(f.read())
+        assert contents[0] == contents[1]
+
+        state = fetch.get_project_state("ERP110686")
+        assert os.path.exists(fetch.get_project_state_file("ERP110686"))
+        assert state.get_status_counts() == {"verified": 1, "failed": 1}
+        assert state.get_accessions(("verified",)) == {"ERR1"}
+        assert [r["run_id"] for r in state.get_rows()] == ["ERR1", "ERR2"]
+
+    def test_md5_should_be_cached_until_the_file_changes(self, tmpdir):
+        entry = run_entry("ERR1", hashlib.md5(CONTENT).hexdigest())
+        fetch = self.fetch_project(str(tmpdir), ["--state-db"], [entry])
+        dest = os.path.join(fetch.get_project_rawdir("ERP110686"), "ERR1.fastq.gz")
+        fetch.get_project_state("ERP110686")
+        with patch.object(abstract_fetch, "md5", wraps=abstract_fetch.md5) as mock:
+            assert fetch._is_file_valid(dest, entry["MD5"])
+            assert not mock.called
+            with open(dest, "ab") as f:
+                f.write(b"\n")
+            assert not fetch._is_file_valid(dest, entry["MD5"])
+            assert mock.call_count == 1
+
+    def test_state_should_import_the_existing_project_files(self, tmpdir):
+        entries = [run_entry("ERR1", hashlib.md5(CONTENT).hexdigest()), run_entry("ERR2", "0" * 32)]
+        fetch = self.fetch_project(str(tmpdir), ["--ignore-errors"], entries)
+        fetch = fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--state-db"])
+        state = fetch.get_project_state("ERP110686")
+        assert [r["run_id"] for r in state.get_rows()] == ["ERR1", "ERR2"]
+        assert state.get_rows()[0]["file"] == ["ERR1.fastq.gz"]
+        assert state.get_accessions() == {"ERR1", "ERR2"}
+        assert fetch.get_downloaded_raw_file_accessions("ERP110686") == {"ERR1", "ERR2"}
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from unittest.mock import patch
+
+from fetchtool import fetch_reads
+from fetchtool.records import RunEntry
+from fetchtool.work_queue import WorkQueue
+
+
+def run_entry(run_id, size):
+    return RunEntry(
+        study_id="ERP110686",
+        run_id=run_id,
+        data_file_path=(f"ftp.sra.ebi.ac.uk/vol1/fastq/{run_id}_1.fastq.gz", f"ftp.sra.ebi.ac.uk/vol1/fastq/{run_id}_2.fastq.gz"),
+        file=(f"{run_id}_1.fastq.gz", f"{run_id}_2.fastq.gz"),
+        md5=("md51", "md52"),
+        file_size=(size, size),
+    )
+
+
+class TestWorkQueue:
+    def test_items_should_be_claimed_once_largest_first(self, tmpdir):
+        path = str(tmpdir.join("queue.sqlite"))
+        first, second = WorkQueue(path, worker_id="first"), WorkQueue(path, worker_id="second")
+        first.add_items([("a", {"n": 1}, 10), ("b", {"n": 2}, 30)])
+        second.add_items([("a", {"n": 1}, 10), ("b", {"n": 2}, 30), ("c", {"n": 3}, 20)])
+        assert [first.claim(), second.claim(), first.claim(), second.claim()] == [("b", {"n": 2}), ("c", {"n": 3}), ("a", {"n": 1}), None]
+        first.complete("b")
+        second.complete("c", success=False)
+        assert first.get_state_counts() == {"done": 1, "leased": 1, "pending": 1}
+        assert second.claim() == ("c", {"n": 3})
+
+    def test_expired_leases_should_be_reclaimed(self, tmpdir):
+        path = str(tmpdir.join("queue.sqlite"))
+        dead, alive = WorkQueue(path, lease=60, max_attempts=2, worker_id="dead"), WorkQueue(path, lease=60, worker_id="alive")
+        dead.add_items([("a", {}, 0)])
+        assert dead.claim() == ("a", {})
+        assert alive.claim() is None
+        alive.heartbeat()
+        now = time.time()
+        with patch("time.time", return_value=now + 61):
+            assert alive.claim() == ("a", {})
+            # the dead worker can't complete an item it lost
+            dead.complete("a")
+            assert alive.get_state_counts() == {"leased": 1}
+        with patch("time.time", return_value=now + 200):
+            # claimed twice without being completed
+            assert dead.claim() is None
+        assert alive.get_state_counts() == {"failed": 1}
+
+    def test_jobs_should_share_the_downloads(self, tmpdir):
+        queue_file = str(tmpdir.join("queue.sqlite"))
+        entries = [run_entry(f"ERR{i}", i) for i in range(5)]
+        downloads = []
+
+        def download(url, dest, md5s):
+            downloads.append((job, os.path.basename(dest)))
+            return True
+
+        fetchers = [
+            fetch_reads.FetchReads(argv=["-p", "ERP110686", "-d", str(tmpdir), "--work-queue", queue_file]) for _ in range(2)
+        ]
+        # a job that dies with a claimed file
+        WorkQueue(queue_file, lease=0.5, worker_id="dead").add_items([("ERP110686/ERR4_1.fastq.gz", {}, 10**9)])
+        WorkQueue(queue_file, worker_id="dead").claim()
+        for job, fetch in enumerate(fetchers):
+            fetch.config["work_queue_lease"] = 0.5
+            with patch.object(fetch, "download_raw_file", side_effect=download):
+                fetch.fetch_project("ERP110686", entries[job * 2 :])
+        assert sorted(f for _, f in downloads) == sorted(f for e in entries[:4] for f in e["file"]) + ["ERR4_2.fastq.gz"]
+        # largest first
+        assert downloads[0] == (0, "ERR4_2.fastq.gz")
+        with patch.object(fetchers[1], "download_raw_file", side_effect=download):
+            fetchers[1].process_work_queue(wait=True)
+        assert downloads[-1] == (1, "ERR4_1.fastq.gz")
+        assert fetchers[1].get_work_queue().get_state_counts() == {"done": 10}
+        assert fetchers[1].get_project_sync_mark("ERP110686") is None